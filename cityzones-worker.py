@@ -30,27 +30,45 @@ from cityzones import riskzones
 from cityzones import overpass
 import os
 import sys
-import subprocess
+import multiprocessing as mp
 import json
 import requests
 import time
-from dotenv import dotenv_values
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cityzones.config import get_config, CONF_DEFAULT_PATH
 from requests_toolbelt import MultipartEncoder
 from datetime import datetime
 
+# orjson is optional, but much faster than json for the task payloads
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 # Load current directory .env or default configuration file
-CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
-if os.path.exists('.env'):
-    config = dotenv_values('.env')
-elif os.path.exists(CONF_DEFAULT_PATH):
-    config = dotenv_values(CONF_DEFAULT_PATH)
-else:
+config = get_config()
+if config == None:
     print(f'No .env file in current path nor configuration file at {CONF_DEFAULT_PATH}. Please create a configuration fom .env.example.')
     exit(1)
 
 sleep_time = int(config['SLEEP_INT'])
 request_timeout = int(config['NET_TIMEOUT'])
 
+# Maximum number of processed tasks waiting for their results to be uploaded
+UPLOADS_QUEUE_SIZE = 2
+
+# RiskZones runs in processes forked from a server that has already imported
+# it, so each task doesn't pay for a new interpreter and the modules imports.
+mp_context = mp.get_context('forkserver')
+mp_context.set_forkserver_preload(['cityzones.riskzones'])
+
+# HTTP session to the web service, keeping the connection alive between requests
+session = requests.Session()
+session.verify = config.get('CA_BUNDLE') or False
+session.headers.update({'X-API-Key': config['API_KEY']})
+
 def logger(text: str):
     print(f'{datetime.now().isoformat()}: {text}', file=sys.stderr)
 
@@ -72,12 +90,23 @@ def delete_task_files(task: dict):
         if os.path.isfile(file):
             os.remove(file)
 
+def write_json(filename: str, data):
+    """
+    Write data to a JSON file.
+    """
+    if orjson != None:
+        with open(filename, 'wb') as fp:
+            fp.write(orjson.dumps(data))
+    else:
+        with open(filename, 'w') as fp:
+            json.dump(data, fp)
+
 def get_task() -> dict:
     """
     Request a task from the web app.
     """
     try:
-        res = requests.get(f'{config["API_URL"]}/tasks', headers={'X-API-Key': config["API_KEY"]}, timeout=request_timeout, verify=False)
+        res = session.get(f'{config["API_URL"]}/tasks', timeout=request_timeout)
     except requests.exceptions.ConnectionError:
         logger(f'There was an error trying to connect to the server.')
         return None
@@ -95,16 +124,29 @@ def get_task() -> dict:
         logger('An error ocurred while trying to get a task from server.')
         return None
 
-    data = res.content.decode()
-    return json.loads(data)
+    if orjson != None:
+        return orjson.loads(res.content)
+
+    return json.loads(res.content)
 
-def process_task(task: dict):
+def fetch_task() -> dict:
     """
-    Process a task.
+    Request a task from the web app and prepare it to be processed.
+    """
+    task = get_task()
+    if task != None and not prepare_task(task):
+        delete_task_files(task)
+        return None
+
+    return task
+
+def prepare_task(task: dict) -> bool:
+    """
+    Write the task files and extract its AoI from Overpass API.
     """
     taskcfg = task['config']
     geojson = task['geojson']
-    logger(f'Starting task {taskcfg["base_filename"]}...')
+    logger(f'Preparing task {taskcfg["base_filename"]}...')
 
     # Apply directories path to configuration
     try:
@@ -121,16 +163,11 @@ def process_task(task: dict):
         filename = f"{config['TASKS_DIR']}/{taskcfg['base_filename']}.json"
     except KeyError:
         logger('A key is missing in task JSON file. Aborting!')
-        return
+        return False
 
     # Write temp configuration files
-    fp_config = open(filename, 'w')
-    json.dump(taskcfg, fp_config)
-    fp_config.close()
-
-    fp_geojson = open(f"{taskcfg['geojson']}", 'w')
-    json.dump(geojson, fp_geojson)
-    fp_geojson.close()
+    write_json(filename, taskcfg)
+    write_json(taskcfg['geojson'], geojson)
 
     # Extract data from Overpass API
     logger('Extracting AoI from Overpass API...')
@@ -138,63 +175,84 @@ def process_task(task: dict):
         overpass.get_osm_from_bbox(taskcfg['pois'], taskcfg["bottom"], taskcfg["left"], taskcfg["top"], taskcfg["right"], request_timeout)
     except requests.exceptions.ConnectionError:
         logger(f'There was an error trying to connect to the Overpass server.')
-        return None
+        return False
     except requests.exceptions.ReadTimeout:
         logger(f'Conenction timed-out while requesting data from Overpass.')
-        return None
+        return False
 
-    # Run riskzones.py
-    try:
-        res = subprocess.run([
-            sys.executable,
-            riskzones.__file__,
-            filename
-        ], timeout=int(config['SUBPROC_TIMEOUT']))
-    except subprocess.TimeoutExpired:
+    return True
+
+def process_task(task: dict) -> bool:
+    """
+    Process a prepared task.
+    """
+    taskcfg = task['config']
+    filename = f"{config['TASKS_DIR']}/{taskcfg['base_filename']}.json"
+    logger(f'Starting task {taskcfg["base_filename"]}...')
+
+    # Run riskzones in a child process forked from the preloaded forkserver
+    process = mp_context.Process(target=riskzones.main, args=(filename,))
+    process.start()
+    process.join(int(config['SUBPROC_TIMEOUT']))
+
+    if process.is_alive():
+        process.terminate()
+        process.join()
         logger("Timeout running RiskZones for the task.")
-        return
-
-    if res.returncode != 0:
-        logger(f'There was an error while running riskzones.py for {taskcfg["base_filename"]}. Return code: {res.returncode}')
-        return
-
-    # Post results to the web app
-    encoder = MultipartEncoder(
-        fields={
-            'task[data][map]': ('map.csv', open(taskcfg['output'], 'rb'), 'text/csv'),
-            'task[data][edus]': ('edus.csv', open(taskcfg['output_edus'], 'rb'), 'text/csv'),
-            'task[data][roads]': ('roads.csv', open(taskcfg['output_roads'], 'rb'), 'text/csv'),
-            'task[data][rivers]': ('rivers.csv', open(taskcfg['output_rivers'], 'rb'), 'text/csv'),
-            'task[data][elevation]': ('elevation.csv', open(taskcfg['output_elevation'], 'rb'), 'text/csv'),
-            'task[data][slope]': ('slope.csv', open(taskcfg['output_slope'], 'rb'), 'text/csv'),
-            'task[res_data]': ('res_data.json', open(taskcfg['res_data'], 'rb'), 'application/json'),
-        }
-    )
-
-    logger(f'Sending data to web service...')
-    try:
-        req = requests.put(
-            f'{config["API_URL"]}/tasks/{task["id"]}',
-            headers={
-                'Content-type': encoder.content_type,
-                'X-API-Key': config["API_KEY"]
-            },
-            data=encoder,
-            timeout=request_timeout,
-            verify=False
+        return False
+
+    if process.exitcode != 0:
+        logger(f'There was an error while running riskzones.py for {taskcfg["base_filename"]}. Return code: {process.exitcode}')
+        return False
+
+    return True
+
+def upload_results(task: dict):
+    """
+    Send the results of a processed task to the web app and delete its files.
+    """
+    taskcfg = task['config']
+
+    # Post results to the web app. The encoder streams the files from disk and
+    # the stack closes them when the request is done.
+    with contextlib.ExitStack() as files:
+        encoder = MultipartEncoder(
+            fields={
+                'task[data][map]': ('map.csv', files.enter_context(open(taskcfg['output'], 'rb')), 'text/csv'),
+                'task[data][edus]': ('edus.csv', files.enter_context(open(taskcfg['output_edus'], 'rb')), 'text/csv'),
+                'task[data][roads]': ('roads.csv', files.enter_context(open(taskcfg['output_roads'], 'rb')), 'text/csv'),
+                'task[data][rivers]': ('rivers.csv', files.enter_context(open(taskcfg['output_rivers'], 'rb')), 'text/csv'),
+                'task[data][elevation]': ('elevation.csv', files.enter_context(open(taskcfg['output_elevation'], 'rb')), 'text/csv'),
+                'task[data][slope]': ('slope.csv', files.enter_context(open(taskcfg['output_slope'], 'rb')), 'text/csv'),
+                'task[res_data]': ('res_data.json', files.enter_context(open(taskcfg['res_data'], 'rb')), 'application/json'),
+            }
         )
 
-        if req.status_code == 201:
-            logger(f'Results for {taskcfg["base_filename"]} sent successfully.')
-        elif req.status_code == 401:
-            logger('Not authorized! Check API_KEY.')
-        else:
-            logger(f'The server reported an error for {taskcfg["base_filename"]} data.')
-        
-    except requests.exceptions.ConnectionError:
-        logger(f'There was an error trying to connect to the server.')
-    except requests.exceptions.ReadTimeout:
-        logger(f'Conenction timed-out while sending the results.')
+        logger(f'Sending data to web service...')
+        try:
+            req = session.put(
+                f'{config["API_URL"]}/tasks/{task["id"]}',
+                headers={
+                    'Content-type': encoder.content_type,
+                    'Content-Length': str(encoder.len)
+                },
+                data=encoder,
+                timeout=request_timeout
+            )
+
+            if req.status_code == 201:
+                logger(f'Results for {taskcfg["base_filename"]} sent successfully.')
+            elif req.status_code == 401:
+                logger('Not authorized! Check API_KEY.')
+            else:
+                logger(f'The server reported an error for {taskcfg["base_filename"]} data.')
+
+        except requests.exceptions.ConnectionError:
+            logger(f'There was an error trying to connect to the server.')
+        except requests.exceptions.ReadTimeout:
+            logger(f'Conenction timed-out while sending the results.')
+
+    delete_task_files(task)
 
     
 if __name__ == '__main__':
@@ -205,10 +263,25 @@ if __name__ == '__main__':
     except FileExistsError:
         pass
 
-    # Main loop
-    while True:
-        task = get_task()
-        if task != None:
-            process_task(task)
-            delete_task_files(task)
-        time.sleep(sleep_time)
+    # Main loop. While a task is processed, the next one is fetched and the
+    # results of the previous ones are uploaded in background threads.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        uploads = deque()
+        next_task = executor.submit(fetch_task)
+
+        while True:
+            task = next_task.result()
+            if task == None:
+                time.sleep(sleep_time)
+                next_task = executor.submit(fetch_task)
+                continue
+
+            next_task = executor.submit(fetch_task)
+            if not process_task(task):
+                delete_task_files(task)
+                continue
+
+            # Don't let finished tasks pile up on disk while the uploads are slow
+            while len(uploads) >= UPLOADS_QUEUE_SIZE:
+                uploads.popleft().result()
+            uploads.append(executor.submit(upload_results, task))
@@ -1,6 +1,26 @@
+import os
+import functools
+from dotenv import dotenv_values
+
 # Multiprocessing
 MP_WORKERS=None  # If None, will use a value returned by the system
 
 # Maximum and minimum values for integers.
 MIN_NUM = 10 ** (-10)
 MAX_NUM = 10 ** 10
+
+# Configuration file used when there is no .env file in the current directory
+CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
+
+@functools.lru_cache(maxsize=1)
+def get_config() -> dict:
+    """
+    Load current directory .env or default configuration file, only once per
+    process. Returns None if none of them exists.
+    """
+    if os.path.exists('.env'):
+        return dotenv_values('.env')
+    elif os.path.exists(CONF_DEFAULT_PATH):
+        return dotenv_values(CONF_DEFAULT_PATH)
+
+    return None
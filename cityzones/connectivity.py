@@ -24,11 +24,16 @@ of the zones.
 After creating a grid object, use the following functions to calculate DPConn:
 """
 
-from dotenv import dotenv_values
 import requests
 import json
 import os
+import math
+import time
+import hashlib
+import functools
+import numpy as np
 import multiprocessing as mp
+from multiprocessing import shared_memory
 try:
     from config import *
     import utils
@@ -36,15 +41,29 @@ except ModuleNotFoundError:
     from cityzones.config import *
     from cityzones import utils
 
+# orjson is optional, but much faster than json for large cells lists
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 # Load current directory .env or default configuration file
-CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
-if os.path.exists('.env'):
-    config = dotenv_values('.env')
-elif os.path.exists(CONF_DEFAULT_PATH):
-    config = dotenv_values(CONF_DEFAULT_PATH)
+config = get_config()
 
 API_ENDPOINT = f'{config["API_URL"]}/cells'
 
+# Cells cache directory and time in seconds a cache entry is valid
+CELLS_CACHE_DIR = config.get('CELLS_CACHE_DIR')
+CELLS_CACHE_TTL = int(config.get('CELLS_CACHE_TTL', 86400))
+
+# Maximum number of zone x cell distances computed at once by a pool worker
+COVERAGE_BLOCK_SIZE = 2 ** 20
+
+# HTTP session to the cells API, keeping the connection alive between requests
+session = requests.Session()
+session.verify = config.get('CA_BUNDLE') or True
+session.headers.update({'accept': 'application/json', 'X-API-Key': config['API_KEY']})
+
 def init_zones(grid: dict, params: dict):
     """
     Initialize every zone in the grid and set their DPConn.
@@ -57,77 +76,213 @@ def init_zones(grid: dict, params: dict):
         zone['dpconn_nets'] = 0
 
     # Calculate the weighted sum of the networks types parameters
-    cells = __get_cells_within_bbox(grid['left'], grid['top'], grid['right'], grid['bottom'])
-    types = set()
+    cells = __deduplicate_cells(__get_cells_within_bbox(grid['left'], grid['top'], grid['right'], grid['bottom']))
+    nets_types = tuple(sorted({cell['type'] for cell in cells}))
 
-    # Collect types
-    for cell in cells:
-        types.add(cell['type'])
-
-    # Compute sum_nets
-    sum_nets = 0
-    for type in types:
-        sum_nets += params['weight']['S'] * params[type]['S'] + params['weight']['T'] * params[type]['T'] + params['weight']['R'] * params[type]['R'] - params['weight']['C'] * params[type]['C']
-
-    # # Compute DPConn for each cell
-    # for id in grid['zones_inside']:
-    #     zone = grid['zones'][id]
-    #     nets_types = set()
-
-    #     sum_coverage = 0
-    #     for cell in cells:
-    #         if __coverage(zone, cell) == True:
-    #             nets_types.add(cell['type'])
-
-    #     for type in nets_types:
-    #         cell_params = params['weight']['S'] * params[type]['S'] + params['weight']['T'] * params[type]['T'] + params['weight']['R'] * params[type]['R'] - params['weight']['C'] * params[type]['C']
-    #         sum_coverage += cell_params
-        
-    #     zone['dpconn'] = sum_coverage / sum_nets
-    #     zone['dpconn_nets'] = str(nets_types)
-    
-    #################################
-    # Compute DPConn for each cell
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for id in grid['zones_inside']:
-            zone = grid['zones'][id]
-            payload.append((zone, cells, sum_nets, params))
-        res = pool.starmap(__compute_zone_dpcoon, payload)
-    
-    for data in res:
-        grid['zones'][data[0]]['dpconn'] = data[1]
-        grid['zones'][data[0]]['dpconn_nets'] = data[2]
+    # Compute the weight of each type and sum_nets
+    type_weight = np.array([
+        params['weight']['S'] * params[type]['S'] + params['weight']['T'] * params[type]['T'] + params['weight']['R'] * params[type]['R'] - params['weight']['C'] * params[type]['C']
+        for type in nets_types
+    ], dtype=np.float64)
+    sum_nets = type_weight.sum()
+
+    # Pack zones and cells data into arrays
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    z_lat = grid['zones_lat'][ids]
+    z_lon = grid['zones_lon'][ids]
+    cells_soa = __cells_to_soa(cells)
+
+    # Compute DPConn for chunks of zones. Cells data is placed in a shared memory
+    # block the workers attach to, so the tasks carry only the zones.
+    n_chunks = (MP_WORKERS or os.cpu_count()) * 4
+    chunks = [chunk for chunk in np.array_split(np.arange(len(ids)), n_chunks) if len(chunk) > 0]
+
+    shm = __share_cells(cells_soa)
+    try:
+        with mp.Pool(processes=MP_WORKERS, initializer=__init_worker, initargs=(shm.name, len(cells_soa[0]), nets_types, type_weight, sum_nets)) as pool:
+            payload = [(ids[chunk], z_lat[chunk], z_lon[chunk]) for chunk in chunks]
+            for chunk_ids, dpconn, nets_mask in pool.imap_unordered(__compute_zones_dpconn, payload, chunksize=1):
+                utils.__set_zones_column(grid, 'dpconn', dpconn, chunk_ids)
+                for id, zone_nets_mask in zip(chunk_ids.tolist(), nets_mask.tolist()):
+                    grid['zones'][id]['dpconn_nets'] = __nets_from_mask(zone_nets_mask, nets_types)
+    finally:
+        shm.close()
+        shm.unlink()
 
     print('Done!')
 
-def __compute_zone_dpcoon(zone: dict, cells: list, sum_nets: float, params: dict) -> float:
-    nets_types = set()
-    sum_coverage = 0
+@functools.lru_cache(maxsize=None)
+def __nets_from_mask(nets_mask: int, types: tuple) -> str:
+    """
+    Get the networks types set string of a zone from its bitmask.
+    """
+    return str({type for i, type in enumerate(types) if nets_mask >> i & 1})
+
+def __share_cells(cells_soa: tuple) -> shared_memory.SharedMemory:
+    """
+    Copy the cells arrays into a new shared memory block, one row per array.
+    Types are stored as floats, which still compare equal to the integer types.
+    """
+    n_cells = len(cells_soa[0])
+    shm = shared_memory.SharedMemory(create=True, size=max(1, 4 * n_cells * np.dtype(np.float64).itemsize))
+    shared = np.ndarray((4, n_cells), dtype=np.float64, buffer=shm.buf)
+    for i, column in enumerate(cells_soa):
+        shared[i] = column
 
-    for cell in cells:
-        if __coverage(zone, cell) == True:
-            nets_types.add(cell['type'])
+    return shm
 
-    for type in nets_types:
-        cell_params = params['weight']['S'] * params[type]['S'] + params['weight']['T'] * params[type]['T'] + params['weight']['R'] * params[type]['R'] - params['weight']['C'] * params[type]['C']
-        sum_coverage += cell_params
-    
-    zone['dpconn'] = sum_coverage / sum_nets
-    zone['dpconn_nets'] = str(nets_types)
+def __init_worker(shm_name: str, n_cells: int, nets_types: tuple, type_weight: np.ndarray, sum_nets: float):
+    """
+    Attach the pool worker to the shared cells data and store the data shared
+    by all tasks. The cells' coordinates are also converted to radians once
+    here, instead of in every distances block.
+    """
+    global __worker_data
+    shm = shared_memory.SharedMemory(name=shm_name)
+    shared = np.ndarray((4, n_cells), dtype=np.float64, buffer=shm.buf)
+    c_lat_rad = np.radians(shared[0])
+    cells_soa = (shared[0], shared[1], shared[2], shared[3], c_lat_rad, np.radians(shared[1]), np.cos(c_lat_rad))
+    __worker_data = (cells_soa, nets_types, type_weight, sum_nets, shm)
 
-    return (zone['id'], zone['dpconn'], zone['dpconn_nets'])
+def __compute_zones_dpconn(task: tuple) -> tuple:
+    """
+    Compute DPConn for a chunk of zones.
+    """
+    ids, z_lat, z_lon = task
+    cells_soa, types, type_weight, sum_nets, _ = __worker_data
+    covered_types = np.zeros((len(ids), len(types)), dtype=bool)
+
+    # Process the chunk in blocks of zones to bound the size of the
+    # zones x cells distance matrix.
+    block = max(1, COVERAGE_BLOCK_SIZE // max(1, len(cells_soa[0])))
+    for start in range(0, len(ids), block):
+        end = start + block
+        covered_types[start:end] = __compute_coverage(z_lat[start:end], z_lon[start:end], cells_soa, types)
+
+    # DPConn is the weighted sum of the networks types covering each zone
+    if sum_nets != 0:
+        dpconn = covered_types @ type_weight / sum_nets
+    else:
+        dpconn = np.zeros(len(ids), dtype=np.float64)
 
-def __coverage(zone: dict, ap: dict):
+    # Networks types covering each zone as a bitmask, one bit per type
+    nets_mask = covered_types @ (1 << np.arange(len(types), dtype=np.int64))
+
+    return ids, dpconn, nets_mask
+
+def __compute_coverage(z_lat: np.ndarray, z_lon: np.ndarray, cells_soa: tuple, types: list) -> np.ndarray:
     """
-    Check if zone is within coverage of an Access Point.
+    Check which networks types cover each zone. A zone is covered by a network
+    type if it is within the range of at least one cell of that type.
     """
-    return utils.__calculate_distance(zone, ap) <= ap['range']
+    c_lat, c_lon, c_range, c_type, c_lat_rad, c_lon_rad, c_cos_lat = cells_soa
+    covered_types = np.zeros((len(z_lat), len(types)), dtype=bool)
+    if len(c_lat) == 0 or len(z_lat) == 0:
+        return covered_types
+
+    # Cells are sorted by latitude, so only the ones in the latitude band the
+    # zones can be reached from must be checked.
+    reach = np.degrees(c_range.max() / utils.EARTH_RADIUS)
+    lo = np.searchsorted(c_lat, z_lat.min() - reach, side='left')
+    hi = np.searchsorted(c_lat, z_lat.max() + reach, side='right')
+    c_lat, c_lon, c_range, c_type = c_lat[lo:hi], c_lon[lo:hi], c_range[lo:hi], c_type[lo:hi]
+    c_lat_rad, c_lon_rad, c_cos_lat = c_lat_rad[lo:hi], c_lon_rad[lo:hi], c_cos_lat[lo:hi]
+
+    # Also skip the cells out of the longitude band the zones can be reached
+    # from. Its width grows with the latitude, so take the one closest to a pole.
+    cos_lat = math.cos(math.radians(min(90.0, np.abs(z_lat).max() + reach)))
+    if cos_lat > 0:
+        lon_reach = np.degrees(2 * math.asin(min(1.0, math.sin(math.radians(reach) / 2) / cos_lat)))
+        in_band = (c_lon >= z_lon.min() - lon_reach) & (c_lon <= z_lon.max() + lon_reach)
+        c_lat, c_lon, c_range, c_type = c_lat[in_band], c_lon[in_band], c_range[in_band], c_type[in_band]
+        c_lat_rad, c_lon_rad, c_cos_lat = c_lat_rad[in_band], c_lon_rad[in_band], c_cos_lat[in_band]
+
+    z_lat_rad = np.radians(z_lat)
+    covered = utils.__calculate_distance_rad(
+        z_lat_rad[:, None], np.radians(z_lon)[:, None], np.cos(z_lat_rad)[:, None],
+        c_lat_rad[None, :], c_lon_rad[None, :], c_cos_lat[None, :]
+    ) <= c_range[None, :]
+    for i, type in enumerate(types):
+        covered_types[:, i] = covered[:, c_type == type].any(axis=1)
+
+    return covered_types
+
+def __deduplicate_cells(cells: list) -> list:
+    """
+    Merge the cells of the same type at the same position (the same tower is
+    usually listed once per operator), keeping the largest range.
+    """
+    unique = {}
+    for cell in cells:
+        key = (round(cell['lat'], 6), round(cell['lon'], 6), cell['type'])
+        prev = unique.get(key)
+        if prev == None or cell['range'] > prev['range']:
+            unique[key] = cell
+
+    return list(unique.values())
+
+def __cells_to_soa(cells: list) -> tuple:
+    """
+    Pack the cells' coordinates, range and type into arrays sorted by latitude.
+    """
+    c_lat = np.fromiter((cell['lat'] for cell in cells), dtype=np.float64, count=len(cells))
+    c_lon = np.fromiter((cell['lon'] for cell in cells), dtype=np.float64, count=len(cells))
+    c_range = np.fromiter((cell['range'] for cell in cells), dtype=np.float64, count=len(cells))
+    c_type = np.array([cell['type'] for cell in cells])
+
+    order = np.argsort(c_lat, kind='stable')
+    return c_lat[order], c_lon[order], c_range[order], c_type[order]
 
 def __get_cells_within_bbox(left: float, top: float, right: float, bottom: float) -> list:
-    res = requests.get(f'{API_ENDPOINT}/{left}/{top}/{right}/{bottom}', headers={'accept': 'application/json', 'X-API-Key': config["API_KEY"]}, timeout=int(config['NET_TIMEOUT']))
+    """
+    Get the list of cells within a bbox. The bbox is enlarged to a 0.001 degree
+    resolution so close requests share the same cache entry.
+    """
+    left = math.floor(left * 1000) / 1000
+    top = math.ceil(top * 1000) / 1000
+    right = math.ceil(right * 1000) / 1000
+    bottom = math.floor(bottom * 1000) / 1000
+    return __get_cells_cached(left, top, right, bottom)
+
+@functools.lru_cache(maxsize=128)
+def __get_cells_cached(left: float, top: float, right: float, bottom: float) -> list:
+    """
+    Get the list of cells from the cache directory or from the API.
+    """
+    cache_file = None
+    if CELLS_CACHE_DIR:
+        key = hashlib.sha1(f'{left}_{top}_{right}_{bottom}'.encode()).hexdigest()
+        cache_file = os.path.join(CELLS_CACHE_DIR, f'{key}.json')
+
+        if os.path.isfile(cache_file) and time.time() - os.path.getmtime(cache_file) < CELLS_CACHE_TTL:
+            try:
+                with open(cache_file, 'rb') as fp:
+                    return __parse_cells(fp.read())
+            except json.JSONDecodeError:
+                pass
+
+    res = session.get(f'{API_ENDPOINT}/{left}/{top}/{right}/{bottom}', timeout=int(config['NET_TIMEOUT']))
 
     if res.status_code != 200:
         raise Exception
-    
-    return json.loads(res.content.decode())
+
+    content = res.content
+
+    # Write the cache file atomically, so a concurrent reader never gets a partial file
+    if cache_file:
+        os.makedirs(CELLS_CACHE_DIR, exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as fp:
+            fp.write(content)
+        os.replace(tmp_file, cache_file)
+
+    return __parse_cells(content)
+
+def __parse_cells(content: bytes) -> list:
+    """
+    Parse a list of cells in JSON format.
+    """
+    if orjson != None:
+        return orjson.loads(content)
+
+    return json.loads(content.decode())
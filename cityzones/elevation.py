@@ -27,10 +27,10 @@ risks:
 - elevation.init_zones(grid)
 """
 
-from dotenv import dotenv_values
 import requests
 import json
-import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 try:
     from config import *
     import utils
@@ -38,27 +38,34 @@ except ModuleNotFoundError:
     from cityzones.config import *
     from cityzones import utils
 
+# orjson is optional, but much faster than json
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 # Load current directory .env or default configuration file
-CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
-if os.path.exists('.env'):
-    config = dotenv_values('.env')
-elif os.path.exists(CONF_DEFAULT_PATH):
-    config = dotenv_values(CONF_DEFAULT_PATH)
+config = get_config()
 
 API_ENDPOINT = 'https://cityzones.fe.up.pt/api/open_elevation/lookup'
 # API_ENDPOINT = 'http://localhost:3000/api/open_elevation/lookup'
 COORD_SET_SIZE = 50
 
+# Number of requests made to the API at the same time
+REQUEST_WORKERS = 8
+
+# HTTP session to the elevation API, keeping the connections alive between requests
+session = requests.Session()
+session.verify = config.get('CA_BUNDLE') or False
+session.headers.update({'X-API-Key': config['API_KEY'], 'Content-Type': 'application/json'})
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=32, max_retries=3))
+
 def init_zones(grid: dict):
     """
     Initialize every zone in the grid and set their elevation.
     """
     print("Setting zones' elevation... ", end='')
 
-    # Initialize grid structure
-    for zone in grid['zones']:
-        zone['elevation'] = 0
-
     # Collect all coordinates
     coord_set = []
     coord = []
@@ -76,35 +83,49 @@ def init_zones(grid: dict):
             coord = []
     coord_set.append(coord) # Add the last set
 
-    # Make a request for each set
+    # Make the requests for the sets concurrently, getting the results in order.
+    # Zones outside the AoI keep elevation 0.
+    elevations = np.zeros(len(grid['zones']), dtype=np.float64)
     zone_start = 0
-    for coord in coord_set:
-        request = {
-            'query': {
-                'locations': coord
-            }
-        }
+    with ThreadPoolExecutor(max_workers=REQUEST_WORKERS) as executor:
+        for results in executor.map(__get_elevations, coord_set):
+            zone_end = zone_start + len(results)
+            elevations[grid['zones_inside'][zone_start:zone_end]] = [result['elevation'] for result in results]
+            zone_start = zone_end
+
+    # Set the elevations
+    utils.__set_zones_column(grid, 'elevation', elevations)
+
+    print('Done!')
+    set_slopes(grid)
 
-        res = requests.post(API_ENDPOINT, data=json.dumps(request), headers={'X-API-Key': config['API_KEY'], 'Content-Type': 'application/json'}, timeout=int(config['NET_TIMEOUT']), verify=False)
+def __get_elevations(coord: list) -> list:
+    """
+    Request the elevations of a set of coordinates from the API.
+    """
+    request = {
+        'query': {
+            'locations': coord
+        }
+    }
 
-        if res.status_code != 200:
-            print(f'STATUS CODE: {res.status_code}')
-            raise Exception
+    if orjson != None:
+        data = orjson.dumps(request)
+    else:
+        data = json.dumps(request)
 
-        elevations = json.loads(res.content.decode())
+    res = session.post(API_ENDPOINT, data=data, timeout=int(config['NET_TIMEOUT']))
 
-        # Set the elevations
-        zone_end = zone_start + len(elevations['results'])
-        i = 0
-        for id in grid['zones_inside'][zone_start:zone_end]:
-            zone = grid['zones'][id]
-            zone['elevation'] = elevations['results'][i]['elevation']
-            i += 1
+    if res.status_code != 200:
+        print(f'STATUS CODE: {res.status_code}')
+        raise Exception
 
-        zone_start = zone_end
+    if orjson != None:
+        elevations = orjson.loads(res.content)
+    else:
+        elevations = json.loads(res.content.decode())
 
-    print('Done!')
-    set_slopes(grid)
+    return elevations['results']
 
 def set_slopes(grid: dict):
     """
@@ -113,18 +134,23 @@ def set_slopes(grid: dict):
     print("Setting zones' slope... ", end='')
     spiral_path = utils.__get_spiral_path(grid, 1)
 
-    for zone in grid['zones']:
-        slopes = [0]
-        zone_id = zone['id']
-        for step in spiral_path:
-            zone_id += step
-            try:
-                nearby_zone = grid['zones'][zone_id]
-                if utils.__calculate_distance_in_grid(grid, zone, nearby_zone) > 3: continue
-                slopes.append(abs(nearby_zone['elevation'] - zone['elevation']) / grid['zone_size'])
-            except IndexError:
-                continue
-
-        zone['slope'] = max(slopes)
+    n_zones = len(grid['zones'])
+    ids = np.arange(n_zones)
+    x = ids % grid['grid_x']
+    y = ids // grid['grid_x']
+    elevations = utils.__get_zones_column(grid, 'elevation')
+    slopes = np.zeros(n_zones, dtype=np.float64)
+
+    # Walk the spiral path for all zones at once. Steps leaving the zones list
+    # or wrapping to a zone far away in the grid are skipped.
+    nearby_ids = ids.copy()
+    for step in spiral_path:
+        nearby_ids += step
+        valid = (nearby_ids >= -n_zones) & (nearby_ids < n_zones)
+        nearby = nearby_ids % n_zones
+        valid &= (nearby % grid['grid_x'] - x) ** 2 + (nearby // grid['grid_x'] - y) ** 2 <= 9
+        slopes = np.maximum(slopes, np.where(valid, np.abs(elevations[nearby] - elevations) / grid['zone_size'], 0))
+
+    utils.__set_zones_column(grid, 'slope', slopes)
 
     print("Done!")
@@ -17,38 +17,46 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from dotenv import dotenv_values
 import requests
 import time
 import json
-import os
 try:
     from config import *
 except ModuleNotFoundError:
     from cityzones.config import *
 
+# orjson is optional, but much faster than json
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 # Load current directory .env or default configuration file
-CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
-if os.path.exists('.env'):
-    config = dotenv_values('.env')
-elif os.path.exists(CONF_DEFAULT_PATH):
-    config = dotenv_values(CONF_DEFAULT_PATH)
+config = get_config()
 
 API_ENDPOINT = 'https://api.mapbox.com/isochrone/v1'
 
+# HTTP session to the Mapbox API, keeping the connection alive between requests
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(max_retries=3))
+
 def get_traveltime(lat: float, lon: float, maxtime: int) -> list:
     """
     Get a list of polygons and holes of the area with `maxtime` minutes
     travel time from the specified coordinates.
     """
 
-    res = requests.get(f'{API_ENDPOINT}/mapbox/driving/{lon},{lat}?contours_minutes={maxtime}&polygons=true&access_token={config["MAPBOX_API_KEY"]}', timeout=int(config['NET_TIMEOUT']))
+    res = session.get(f'{API_ENDPOINT}/mapbox/driving/{lon},{lat}?contours_minutes={maxtime}&polygons=true&access_token={config["MAPBOX_API_KEY"]}', timeout=int(config['NET_TIMEOUT']))
 
     if res.status_code != 200:
         print(f'STATUS CODE: {res.status_code}')
         raise Exception
 
-    response = json.loads(res.content.decode())
+    if orjson != None:
+        response = orjson.loads(res.content)
+    else:
+        response = json.loads(res.content.decode())
+
     poligons = []
 
     for feature in response['features']:
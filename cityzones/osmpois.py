@@ -18,130 +18,201 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import xml.etree.ElementTree as ET
+import os
+import pickle
 
-def extract_nodes(file: str) -> tuple[dict, dict, dict]:
+# Tags of the ways and relations that are paths (roads, rivers, ...)
+PATHS_KEYS = {'highway', 'water', 'waterway'}
+
+def extract_nodes(file: str, pois_keys: set = None) -> tuple[dict, dict, dict]:
     '''
-    Extract nodes, ways and relations from an OSM file.
+    Extract nodes, ways and relations from an OSM file. Only the nodes with
+    tags are returned, the ways and relations nodes are (lat, lon) tuples.
+    If pois_keys is set, only the nodes with any of these tags and the
+    relations with any of these tags or a path tag are returned.
     '''
-    tree = ET.parse(file)
-    root = tree.getroot()
-
+    relations_keys = None if pois_keys == None else pois_keys | PATHS_KEYS
+    coordinates = {}
     nodes = {}
     ways = {}
     relations = {}
 
-    # Collect nodes from OSM
-    for node in root.iter('node'):
-        id = int(node.get('id'))
-        node_data = {}
-
-        for tag in node.iter('tag'):
-            node_data[tag.get('k')] = tag.get('v')
-
-        node_data['lat'] = float(node.get('lat'))
-        node_data['lon'] = float(node.get('lon'))
-        node_data['weight'] = 1.0
-        node_data['badpoi'] = False
-        node_data['zone_id'] = None
-
-        nodes[id] = node_data
+    # Parse the OSM file as a stream in a single pass. OSM files list nodes
+    # before ways and ways before relations, so every reference is already
+    # known when it is found. Each element is dropped from the tree after
+    # being processed to keep memory usage low.
+    context = ET.iterparse(file, events=('start', 'end'))
+    _, root = next(context)
 
-    # Collect ways from OSM
-    for way in root.iter('way'):
-        id = int(way.get('id'))
-        way_data = {}
-
-        for tag in way.iter('tag'):
-            way_data[tag.get('k')] = tag.get('v')
-
-        way_data['nodes'] = []
+    for event, element in context:
+        if event != 'end':
+            continue
 
-        # Ways contain a set of nodes, so we must gather them
-        for node in way.iter('nd'):
-            node_id = int(node.get('ref'))
-            if node_id in nodes.keys():
-                way_data['nodes'].append(nodes[node_id])
+        # Collect nodes from OSM. Most nodes are only points of ways, so only
+        # their coordinates are kept, and a dict is built for the tagged ones.
+        if element.tag == 'node':
+            id = int(element.get('id'))
+            lat = float(element.get('lat'))
+            lon = float(element.get('lon'))
+            coordinates[id] = (lat, lon)
+
+            if len(element) > 0:
+                node_data = {}
+
+                for child in element:
+                    if child.tag == 'tag':
+                        node_data[child.get('k')] = child.get('v')
+
+                if pois_keys != None and not node_data.keys() & pois_keys:
+                    root.clear()
+                    continue
+
+                node_data['lat'] = lat
+                node_data['lon'] = lon
+                node_data['weight'] = 1.0
+                node_data['badpoi'] = False
+                node_data['zone_id'] = None
+
+                nodes[id] = node_data
+
+        # Collect ways from OSM
+        elif element.tag == 'way':
+            id = int(element.get('id'))
+            way_data = {}
+            way_nodes = []
+
+            # Ways contain a set of nodes, so we must gather them along with the tags
+            for child in element:
+                if child.tag == 'tag':
+                    way_data[child.get('k')] = child.get('v')
+                elif child.tag == 'nd':
+                    node_id = int(child.get('ref'))
+                    if node_id in coordinates:
+                        way_nodes.append(coordinates[node_id])
+
+            way_data['nodes'] = way_nodes
+            ways[id] = way_data
+
+        # Collect relations from OSM
+        elif element.tag == 'relation':
+            id = int(element.get('id'))
+            relation_data = {}
+            relation_ways = []
+            relation_nodes = []
+
+            for child in element:
+                if child.tag == 'tag':
+                    relation_data[child.get('k')] = child.get('v')
+
+            if relations_keys != None and not relation_data.keys() & relations_keys:
+                root.clear()
+                continue
+
+            # Relations contain a set of ways, so we must gather them
+            for child in element:
+                if child.tag == 'member':
+                    member_id = int(child.get('ref'))
+                    if child.get('type') == 'way' and member_id in ways:
+                        relation_ways.append(ways[member_id])
+                        relation_nodes += ways[member_id]['nodes']
+                    if child.get('type') == 'node' and member_id in coordinates:
+                        relation_nodes.append(coordinates[member_id])
+
+            relation_data['ways'] = relation_ways
+            relation_data['nodes'] = relation_nodes
+            relations[id] = relation_data
+
+        else:
+            continue
 
-        ways[id] = way_data
+        root.clear()
 
-    # Collect relations from OSM
-    for relation in root.iter('relation'):
-        id = int(relation.get('id'))
-        relation_data = {}
+    return nodes, ways, relations
 
-        for tag in relation.iter('tag'):
-            relation_data[tag.get('k')] = tag.get('v')
+def extract_pois(file: str, pois_types: dict, cache_file: str = None) -> tuple[list, list, list]:
+    '''
+    Extract paths and PoIs of types pois_types from OSM file. If cache_file is
+    set, the results are stored in it and reused while the OSM file and the
+    PoIs types are the same.
+    '''
+    if cache_file != None:
+        stat = os.stat(file)
+        cache_key = (stat.st_size, stat.st_mtime_ns, pois_types)
 
-        relation_data['ways'] = []
-        relation_data['nodes'] = []
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'rb') as fp:
+                    cache = pickle.load(fp)
+                if cache['key'] == cache_key:
+                    return cache['data']
+            except (pickle.UnpicklingError, EOFError, KeyError, TypeError):
+                pass
 
-        # Relations contain a set of ways, so we must gather them
-        for member in relation.iter('member'):
-            member_id = int(member.get('ref'))
-            if member.get('type') == 'way' and member_id in ways.keys():
-                relation_data['ways'].append(ways[member_id])
-                relation_data['nodes'] += ways[member_id]['nodes']
-            if member.get('type') == 'node' and member_id in nodes.keys():
-                relation_data['nodes'].append(nodes[member_id])
+        data = __extract_pois(file, pois_types)
+        with open(cache_file, 'wb') as fp:
+            pickle.dump({'key': cache_key, 'data': data}, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
-        relations[id] = relation_data
+        return data
 
-    return nodes, ways, relations
+    return __extract_pois(file, pois_types)
 
-def extract_pois(file: str, pois_types: dict) -> tuple[list, list, list]:
+def __extract_pois(file: str, pois_types: dict) -> tuple[list, list, list]:
     '''
     Extract paths and PoIs of types pois_types from OSM file.
     '''
-    nodes, ways, relations = extract_nodes(file)
+    # Most elements have none of the PoIs tags, so first check the keys they
+    # have in common in a single set operation. The nodes and relations
+    # without any are not even kept by extract_nodes.
+    pois_keys = set(pois_types)
+    nodes, ways, relations = extract_nodes(file, pois_keys)
 
     pois = []
     roads = []
     rivers = []
 
     # Check data in nodes
-    for id in nodes.keys():
-        node = nodes[id]
-        for node_key in node.keys():
-            if node_key in pois_types and node[node_key] in pois_types[node_key].keys():
-                w = pois_types[node_key][node[node_key]]['w']
-                poi_data = {
-                    'lat': float(node.get('lat')),
-                    'lon': float(node.get('lon')),
-                    'weight': w,
-                    'badpoi': False if w >= 0 else True,
-                    'zone_id': None
-                }
-                pois.append(poi_data)
+    for node in nodes.values():
+        if node.keys() & pois_keys:
+            for node_key in node:
+                if node_key in pois_types and node[node_key] in pois_types[node_key]:
+                    w = pois_types[node_key][node[node_key]]['w']
+                    poi_data = {
+                        'lat': node['lat'],
+                        'lon': node['lon'],
+                        'weight': w,
+                        'badpoi': False if w >= 0 else True,
+                        'zone_id': None
+                    }
+                    pois.append(poi_data)
 
     # Check data in ways
-    for id in ways.keys():
-        way = ways[id]
+    for way in ways.values():
         if len(way['nodes']) == 0:
             continue
         first_node = way['nodes'][0]
 
-        for way_key in way.keys():
-            if way_key in pois_types and way[way_key] in pois_types[way_key].keys():
-                w = pois_types[way_key][way[way_key]]['w']
-                poi_data = {
-                    'lat': float(first_node.get('lat')),
-                    'lon': float(first_node.get('lon')),
-                    'weight': w,
-                    'badpoi': False if w >= 0 else True,
-                    'zone_id': None
-                }
-                pois.append(poi_data)
+        if way.keys() & pois_keys:
+            for way_key in way:
+                if way_key in pois_types and way[way_key] in pois_types[way_key]:
+                    w = pois_types[way_key][way[way_key]]['w']
+                    poi_data = {
+                        'lat': first_node[0],
+                        'lon': first_node[1],
+                        'weight': w,
+                        'badpoi': False if w >= 0 else True,
+                        'zone_id': None
+                    }
+                    pois.append(poi_data)
 
         # Check for paths (roads, rivers, ...)
         if len(way['nodes']) >= 2:
             for i in range(len(way['nodes']) - 1):
-                path_point = {}
-                path_point['start'] = {}
-                path_point['end'] = {}
-                path_point['start']['lat'] = way['nodes'][i]['lat']
-                path_point['start']['lon'] = way['nodes'][i]['lon']
-                path_point['end']['lat'] = way['nodes'][i + 1]['lat']
-                path_point['end']['lon'] = way['nodes'][i + 1]['lon']
+                start_lat, start_lon = way['nodes'][i]
+                end_lat, end_lon = way['nodes'][i + 1]
+                path_point = {
+                    'start': {'lat': start_lat, 'lon': start_lon},
+                    'end': {'lat': end_lat, 'lon': end_lon}
+                }
 
                 if way.get('highway') in ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified', 'residential']:
                     roads.append(path_point)
@@ -149,34 +220,33 @@ def extract_pois(file: str, pois_types: dict) -> tuple[list, list, list]:
                     rivers.append(path_point)
 
     # Check data in relations
-    for id in relations.keys():
-        relation = relations[id]
+    for relation in relations.values():
         if len(relation['nodes']) == 0:
             continue
         first_node = relation['nodes'][0]
 
-        for relation_key in relation.keys():
-            if relation_key in pois_types and relation[relation_key] in pois_types[relation_key].keys():
-                w = pois_types[relation_key][relation[relation_key]]['w']
-                poi_data = {
-                    'lat': float(first_node.get('lat')),
-                    'lon': float(first_node.get('lon')),
-                    'weight': w,
-                    'badpoi': False if w >= 0 else True,
-                    'zone_id': None
-                }
-                pois.append(poi_data)
+        if relation.keys() & pois_keys:
+            for relation_key in relation:
+                if relation_key in pois_types and relation[relation_key] in pois_types[relation_key]:
+                    w = pois_types[relation_key][relation[relation_key]]['w']
+                    poi_data = {
+                        'lat': first_node[0],
+                        'lon': first_node[1],
+                        'weight': w,
+                        'badpoi': False if w >= 0 else True,
+                        'zone_id': None
+                    }
+                    pois.append(poi_data)
 
         # Check for paths (roads, rivers, ...)
         if len(relation['nodes']) >= 2:
             for i in range(len(relation['nodes']) - 1):
-                path_point = {}
-                path_point['start'] = {}
-                path_point['end'] = {}
-                path_point['start']['lat'] = relation['nodes'][i]['lat']
-                path_point['start']['lon'] = relation['nodes'][i]['lon']
-                path_point['end']['lat'] = relation['nodes'][i + 1]['lat']
-                path_point['end']['lon'] = relation['nodes'][i + 1]['lon']
+                start_lat, start_lon = relation['nodes'][i]
+                end_lat, end_lon = relation['nodes'][i + 1]
+                path_point = {
+                    'start': {'lat': start_lat, 'lon': start_lon},
+                    'end': {'lat': end_lat, 'lon': end_lon}
+                }
 
                 if relation.get('highway') in ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified', 'residential']:
                     roads.append(path_point)
@@ -190,13 +260,15 @@ Main program.
 '''
 if __name__ == '__main__':
     file = input('Input OSM filename: ')
-    pois_type = input('Input pois type (hospital, police, fire_station): ')
-    pois = extract_pois(file, {'amenity': pois_type})
+    pois_type = input('Input pois types, separated by commas (hospital, police, fire_station): ')
+
+    # Match the amenities exactly, not as substrings of the input
+    amenities = {amenity.strip(): {'w': 1.0} for amenity in pois_type.split(',') if amenity.strip()}
+    pois, _, _ = extract_pois(file, {'amenity': amenities})
 
     message = f"{len(pois)} PoIs found:"
     print(f"\n{message}")
     print('-' * len(message))
 
     for poi in pois:
-        print(f"Name: {poi['name']}")
         print(f"Coordinates: {poi['lon']},{poi['lat']}\n")
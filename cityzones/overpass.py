@@ -18,9 +18,17 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import requests
+import shutil
 
 API_ENDPOINT = 'https://overpass-api.de/api/interpreter'
 
+# Size of the blocks written to disk while downloading OSM data
+COPY_BUFFER_SIZE = 2 ** 20
+
+# HTTP session to the Overpass API, keeping the connection alive between requests
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(max_retries=3))
+
 def get_osm_from_bbox(filename: str, bottom: float, left: float, top: float, right: float, request_timeout: int) -> str:
     """
     Query Overpass API and request the OSM from the bounding box specified by the parameters.
@@ -31,11 +39,11 @@ def get_osm_from_bbox(filename: str, bottom: float, left: float, top: float, rig
       out;
     '''
 
-    res = requests.get(API_ENDPOINT, data=query, stream=True, timeout=request_timeout)
-    with open(filename, 'wb') as fp:
+    # Copy the response body straight to the file in large blocks as it arrives
+    with session.get(API_ENDPOINT, data=query, stream=True, timeout=request_timeout) as res, open(filename, 'wb') as fp:
+        res.raw.decode_content = True
         try:
-            for chunk in res.iter_content():
-                fp.write(chunk)
+            shutil.copyfileobj(res.raw, fp, COPY_BUFFER_SIZE)
         except Exception:
             pass
 
@@ -46,19 +54,17 @@ def get_osm_from_polygon(filename: str, polygon: list, request_timeout: int) ->
     Query Overpass API and request the OSM from the polygon specified by the parameters.
     The OSM data will arrive in XML format.
     """
-    poly = ''
-    for coordinate in polygon:
-        poly += f'{coordinate[1]} {coordinate[0]} '
-    
+    poly = ' '.join(f'{coordinate[1]} {coordinate[0]}' for coordinate in polygon)
+
     query = f'''
-      nwr(poly:"{poly.strip()}");
+      nwr(poly:"{poly}");
       out;
     '''
 
-    res = requests.get(API_ENDPOINT, data=query, timeout=request_timeout)
-    with open(filename, 'wb') as fp:
-        for chunk in res.iter_content():
-            fp.write(chunk)
+    # Copy the response body straight to the file in large blocks as it arrives
+    with session.get(API_ENDPOINT, data=query, stream=True, timeout=request_timeout) as res, open(filename, 'wb') as fp:
+        res.raw.decode_content = True
+        shutil.copyfileobj(res.raw, fp, COPY_BUFFER_SIZE)
 
     return res.status_code
 
@@ -74,15 +80,14 @@ def get_osm_from_geojson(filename: str, geo_json: dict, request_timeout: int) ->
     
     query = '(\n'
     for polygon in poly_list:
-        for coordinate in polygon:
-            poly += f'{coordinate[0]} {coordinate[1]} '
-        query += f'  nwr(poly:"{poly.strip()}");\n'
+        poly = ' '.join(f'{coordinate[1]} {coordinate[0]}' for coordinate in polygon)
+        query += f'  nwr(poly:"{poly}");\n'
     
     query += ')\nout;\n'
 
-    res = requests.get(API_ENDPOINT, data=query, timeout=request_timeout)
-    with open(filename, 'wb') as fp:
-        for chunk in res.iter_content():
-            fp.write(chunk)
+    # Copy the response body straight to the file in large blocks as it arrives
+    with session.get(API_ENDPOINT, data=query, stream=True, timeout=request_timeout) as res, open(filename, 'wb') as fp:
+        res.raw.decode_content = True
+        shutil.copyfileobj(res.raw, fp, COPY_BUFFER_SIZE)
 
     return res.status_code
@@ -33,6 +33,7 @@ risks:
 """
 
 try:
+    from config import get_config, CONF_DEFAULT_PATH
     import utils
     import osmpois
     import overpass
@@ -41,6 +42,7 @@ try:
     import connectivity
     import mapbox
 except ModuleNotFoundError:
+    from cityzones.config import get_config, CONF_DEFAULT_PATH
     from cityzones import utils
     from cityzones import osmpois
     from cityzones import overpass
@@ -51,22 +53,15 @@ except ModuleNotFoundError:
 
 import time
 import json
+import pickle
 import geojson
 import sys
 import os
-import random
 import resource
 import subprocess
 import math
+import numpy as np
 import multiprocessing as mp
-from dotenv import dotenv_values
-
-# Exception classes.
-class OutOfBounds(Exception):
-    pass
-
-class SkipZone(Exception):
-    pass
 
 # Exit status
 EXIT_OK = 0
@@ -84,12 +79,8 @@ EDU_LOOSE = 1
 EDU_TIGHT = 2
 
 # Load current directory .env or default configuration file
-CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
-if os.path.exists('.env'):
-    config = dotenv_values('.env')
-elif os.path.exists(CONF_DEFAULT_PATH):
-    config = dotenv_values(CONF_DEFAULT_PATH)
-else:
+config = get_config()
+if config == None:
     print(f'No .env file in current path nor configuration file at {CONF_DEFAULT_PATH}. Please create a configuration fom .env.example.')
     exit(EXIT_NO_CONF)
 
@@ -112,6 +103,9 @@ CONNECTED = 5
 # Multiprocessing
 MP_WORKERS=None  # If None, will use a value returned by the system
 
+# Number of zones processed at once by the vectorized computations
+ZONES_BLOCK_SIZE = 2 ** 16
+
 def create_riskzones_grid(left: float, bottom: float, right: float, top: float, zone_size: int, M: int, n_edus: dict) -> dict:
     """
     Create a riskzones grid object for futher manipulation.
@@ -129,6 +123,7 @@ def create_riskzones_grid(left: float, bottom: float, right: float, top: float,
         'n_edus_tight': n_edus['tight'],
         'edus': {},
         'polygons': [],
+        'polygons_mbr': [],
         'pol_points': 0,
         'zones': [],
         'zones_inside': [],
@@ -164,28 +159,33 @@ def init_zones(grid: dict):
     grid['zones'].clear()
     grid['zones_inside'].clear()
 
-    for j in range(grid['grid_y']):
-        for i in range(grid['grid_x']):
-            zone = {
-                'id': j * grid['grid_x'] + i,
-                'lat': (j / grid['grid_y'] * grid['height']) + grid['bottom'] + grid['zone_center']['y'],
-                'lon': (i / grid['grid_x'] * grid['width']) + grid['left'] + grid['zone_center']['x'],
-                'risk': 1.0,
-                'risk_river': 0,
-                'river_dist': None,
-                'river_dist_normalized': None,
-                'RL': grid['M'],
-                'inside': True,
-                'has_edu': False,
-                'edu_type': EDU_NONE,
-                'is_road': False,
-                'is_river': False,
-                'urban_prob': 0
-            }
+    # Compute the zones' coordinates for the whole grid at once
+    j, i = np.divmod(np.arange(grid['grid_x'] * grid['grid_y']), grid['grid_x'])
+    grid['zones_lat'] = (j / grid['grid_y'] * grid['height']) + grid['bottom'] + grid['zone_center']['y']
+    grid['zones_lon'] = (i / grid['grid_x'] * grid['width']) + grid['left'] + grid['zone_center']['x']
+    grid['zones_cos_lat'] = np.cos(np.radians(grid['zones_lat']))
+
+    for id, (lat, lon) in enumerate(zip(grid['zones_lat'].tolist(), grid['zones_lon'].tolist())):
+        zone = {
+            'id': id,
+            'lat': lat,
+            'lon': lon,
+            'risk': 1.0,
+            'risk_river': 0,
+            'river_dist': None,
+            'river_dist_normalized': None,
+            'RL': grid['M'],
+            'inside': True,
+            'has_edu': False,
+            'edu_type': EDU_NONE,
+            'is_road': False,
+            'is_river': False,
+            'urban_prob': 0
+        }
+
+        grid['zones'].append(zone)
+        grid['zones_inside'].append(zone['id'])
 
-            grid['zones'].append(zone)
-            grid['zones_inside'].append(zone['id'])
-    
     print('Done!')
 
 def load_zones(grid: dict, zones: list):
@@ -202,15 +202,28 @@ def load_zones(grid: dict, zones: list):
         if zone['inside']:
             grid['zones_inside'].append(zone['id'])
 
+    init_zones_coordinates(grid)
+
+def init_zones_coordinates(grid: dict):
+    """
+    Store the zones' coordinates as arrays indexed by zone id, so the layers
+    can compute over all zones at once instead of looping over the dicts.
+    """
+    grid['zones_lat'] = utils.__get_zones_column(grid, 'lat')
+    grid['zones_lon'] = utils.__get_zones_column(grid, 'lon')
+    grid['zones_cos_lat'] = np.cos(np.radians(grid['zones_lat']))
+
 def add_polygon(grid: dict, polygons: list):
     """
     Add the polygons in the list into the grid.
     """
     print('Adding polygons... ', end='')
     grid['polygons'].clear()
+    grid['polygons_mbr'].clear()
     grid['pol_points'] = 0
     for polygon in polygons:
         grid['polygons'].append(polygon)
+        grid['polygons_mbr'].append(get_polygon_mbr(polygon))
         grid['pol_points'] += len(polygon)
     
     print('Done!')
@@ -221,29 +234,41 @@ def insert_pois_into_zones(grid: dict):
     """
     print('Inserting PoIs into zones... ', end='')
 
-    for poi in grid['pois']:
-        poi['zone_id'] = None
-
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for poi in grid['pois']:
-            payload.append((poi, grid['zones'], grid['zone_size']))
-        grid['pois'] = pool.starmap(update_poi_zone, payload)
+    zones_ids = get_pois_zones(grid, grid['pois'], grid['zone_size'])
+    grid['pois'] = [dict(poi, zone_id=zone_id) for poi, zone_id in zip(grid['pois'], zones_ids)]
     
     print('Done!')
 
-def update_poi_zone(poi: dict, zones: list, tolerance: int) -> int:
+def get_pois_zones(grid: dict, pois: list, tolerance: int) -> list:
     """
-    Update the zone_id of the PoI.
+    Get the id of the nearest zone within the tolerance distance from each PoI,
+    or None if there is no zone that near.
     """
-    prev_dist = 9999
-    for zone in zones:
-        dist = utils.__calculate_distance(poi, zone)
-        if dist <= tolerance and (poi['zone_id'] == None or dist < prev_dist):
-            poi['zone_id'] = zone['id']
-            prev_dist = dist
-    
-    return poi
+    if len(pois) == 0:
+        return []
+
+    p_lat = np.fromiter((poi['lat'] for poi in pois), dtype=np.float64, count=len(pois))
+    p_lon = np.fromiter((poi['lon'] for poi in pois), dtype=np.float64, count=len(pois))
+
+    # Zones are at least tolerance wide, so only the zones up to two zones
+    # away from the one each PoI falls in must be checked. The offsets are in
+    # ids order, so the first nearest zone is the one with the lowest id.
+    x, y = coordinates_to_position(grid, p_lat, p_lon)
+    offsets = np.arange(-2, 3)
+    x = np.clip(x, 0, grid['grid_x'] - 1)[:, None, None] + offsets[None, None, :]
+    y = np.clip(y, 0, grid['grid_y'] - 1)[:, None, None] + offsets[None, :, None]
+    x, y = np.broadcast_arrays(x, y)
+    x = x.reshape(len(pois), -1)
+    y = y.reshape(len(pois), -1)
+
+    valid = (x >= 0) & (x < grid['grid_x']) & (y >= 0) & (y < grid['grid_y'])
+    candidates = np.where(valid, y * grid['grid_x'] + x, 0)
+    dist = utils.__calculate_distance_vec(grid['zones_lat'][candidates], grid['zones_lon'][candidates], p_lat[:, None], p_lon[:, None])
+    dist = np.where(valid & (dist <= tolerance), dist, np.inf)
+
+    nearest = np.argmin(dist, axis=1)
+    found = np.isfinite(dist[np.arange(len(pois)), nearest])
+    return [int(id) if ok else None for id, ok in zip(candidates[np.arange(len(pois)), nearest].tolist(), found.tolist())]
 
 def init_zones_by_polygon(grid: dict):
     """
@@ -252,16 +277,12 @@ def init_zones_by_polygon(grid: dict):
     print('Checking zones inside the polygon... ', end='')
 
     grid['zones_inside'].clear()
-    
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for zone in grid['zones']:
-            payload.append((zone, grid['polygons']))
-        grid['zones'] = pool.starmap(update_zone_inside_polygon_set, payload)
-    
-    for zone in grid['zones']:
-        if zone['inside'] == True:
-            grid['zones_inside'].append(zone['id'])
+
+    inside = check_zones_in_polygons_set(grid, grid['polygons'])
+    for zone, zone_inside in zip(grid['zones'], inside.tolist()):
+        zone['inside'] = zone_inside
+
+    grid['zones_inside'].extend(np.flatnonzero(inside).tolist())
 
     print('Done!')
     print(f'{len(grid["zones_inside"])} of {len(grid["zones"])} zones inside the polygon.')
@@ -272,106 +293,138 @@ def init_pois_by_polygon(grid: dict) -> list:
     """
     print(f'Checking PoIs inside the polygon... ', end='')
 
-    pois_results = []
     grid['pois_inside'].clear()
-    
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for poi in grid['pois']:
-            payload.append((poi, grid['polygons']))
-        pois_results = pool.starmap(update_zone_inside_polygon_set, payload)
-    
-    for poi in pois_results:
-        if poi['inside'] == True:
-            grid['pois_inside'].append(poi)
+
+    p_lat = np.fromiter((poi['lat'] for poi in grid['pois']), dtype=np.float64, count=len(grid['pois']))
+    p_lon = np.fromiter((poi['lon'] for poi in grid['pois']), dtype=np.float64, count=len(grid['pois']))
+    inside = check_points_in_polygons_set(p_lat, p_lon, grid['polygons'], grid['polygons_mbr'])
+
+    for poi, poi_inside in zip(grid['pois'], inside.tolist()):
+        if poi_inside:
+            grid['pois_inside'].append(dict(poi, inside=True))
 
     print('Done!')
     print(f'{len(grid["pois_inside"])} of {len(grid["pois"])} PoIs inside the polygon.')
 
-def update_zone_inside_polygon_set(zone: dict, polygons: dict) -> bool:
+def check_points_in_polygons_set(lat: np.ndarray, lon: np.ndarray, polygons: list, mbrs: list = None) -> np.ndarray:
     """
-    Update a zone information if it is inside any polygon in a polygons set.
+    Check which points are inside any polygon in a polygons set. If the
+    polygons MBRs are given, the polygons that can't contain any of the
+    points are skipped.
     """
-    zone['inside'] = check_zone_in_polygons_set(zone, polygons)
-    return zone
+    inside = np.zeros(len(lat), dtype=bool)
+    if len(lat) == 0:
+        return inside
+
+    if mbrs == None:
+        mbrs = [None] * len(polygons)
 
-def check_zone_in_polygons_set(zone: dict, polygons: list) -> bool:
+    lat_min, lat_max, lon_min = lat.min(), lat.max(), lon.min()
+    for pol, mbr in zip(polygons, mbrs):
+        # Points out of the polygon's latitude range or at the right of it
+        # are never inside it
+        if mbr != None and (lat_max < mbr[1] or lat_min > mbr[3] or lon_min > mbr[2]):
+            continue
+
+        inside |= check_points_in_polygon(lat, lon, pol)
+
+    return inside
+
+def get_polygon_mbr(polygon: list) -> tuple:
     """
-    Check if a zone is inside any polygon in a polygons set.
+    Get the minimum bounding rectangle of a polygon as (left, bottom, right, top).
     """
-    for pol in polygons:
-        if check_zone_in_polygon(zone, pol):
-            return True
+    if len(polygon) == 0:
+        return None
 
-    return False
+    lons = [point[0] for point in polygon]
+    lats = [point[1] for point in polygon]
+    return (min(lons), min(lats), max(lons), max(lats))
 
-def check_zone_in_polygon(zone: dict, polygon: list) -> bool:
+def check_points_in_polygon(lat: np.ndarray, lon: np.ndarray, polygon: list) -> np.ndarray:
     """
-    Check if a zone is inside a polygon.
+    Check which points are inside a polygon, casting a ray from each point to
+    its right and counting the polygon edges it intersects.
     """
-    line1 = {
-        'p1': {
-            'lon': zone['lon'],
-            'lat': zone['lat']
-        },
-        'p2': {
-            'lon': zone['lon'] + 180,
-            'lat': zone['lat']
-        }
-    }
+    inside = np.zeros(len(lat), dtype=bool)
+    if len(polygon) == 0:
+        return inside
 
-    intersec = 0
-    for i in range(-1, len(polygon) - 1):
-        line2 = {
-            'p1': {
-                'lon': polygon[i][0],
-                'lat': polygon[i][1]
-            },
-            'p2': {
-                'lon': polygon[i + 1][0],
-                'lat': polygon[i + 1][1]
-            }
-        }
+    vertices = np.asarray(polygon, dtype=np.float64)[:, :2]
+    v_lon = vertices[:, 0]
+    v_lat = vertices[:, 1]
 
-        # We only need to check the zone against lines at its right and if zone's latitude
-        # is between the line's latitudes
-        if  (line2['p1']['lon'] >= zone['lon'] or line2['p2']['lon'] >= zone['lon']) and \
-            ((line2['p1']['lat'] <= zone['lat'] <= line2['p2']['lat']) or ((line2['p2']['lat'] <= zone['lat'] <= line2['p1']['lat']))):
-            if check_intersection(line1, line2):
-                intersec += 1
-    
-    return intersec % 2 == 1
+    # Points out of the polygon's latitude range or at the right of it don't
+    # intersect any edge
+    candidates = np.flatnonzero((lat >= v_lat.min()) & (lat <= v_lat.max()) & (lon <= v_lon.max()))
+    c_lat = lat[candidates]
+    c_lon = lon[candidates]
+    intersec = np.zeros(len(candidates), dtype=np.int64)
+
+    for i in range(-1, len(vertices) - 1):
+        lon1, lat1 = v_lon[i], v_lat[i]
+        lon2, lat2 = v_lon[i + 1], v_lat[i + 1]
+
+        # We only need to check the points against lines at their right and if
+        # the point's latitude is between the line's latitudes
+        check = ((lon1 >= c_lon) | (lon2 >= c_lon)) & \
+                (((lat1 <= c_lat) & (c_lat <= lat2)) | ((lat2 <= c_lat) & (c_lat <= lat1)))
+        if check.any():
+            intersec[check] += check_edge_intersection(c_lat[check], c_lon[check], lon1, lat1, lon2, lat2)
+
+    inside[candidates] = intersec % 2 == 1
+    return inside
 
-def sign(x: float) -> int:
+def check_zones_in_polygons_set(grid: dict, polygons: list) -> np.ndarray:
     """
-    Return the signal of x.
+    Check which zones of the grid are inside any polygon in a polygons set.
     """
-    if x < 0:
-        return -1
-    elif x > 0:
-        return 1
-    else:
-        return 0
+    inside = np.zeros(len(grid['zones_lat']), dtype=bool)
+    for pol in polygons:
+        inside |= check_zones_in_polygon(grid, pol)
+
+    return inside
+
+def check_zones_in_polygon(grid: dict, polygon: list) -> np.ndarray:
+    """
+    Check which zones of the grid are inside a polygon, like
+    check_points_in_polygon(). The zones are laid out in rows of the same
+    latitude and growing longitude, so each edge is only checked against the
+    block of zones within its latitude range and at its left.
+    """
+    rows_lat = grid['zones_lat'].reshape(grid['grid_y'], grid['grid_x'])
+    rows_lon = grid['zones_lon'].reshape(grid['grid_y'], grid['grid_x'])
+    intersec = np.zeros(rows_lat.shape, dtype=np.int64)
+
+    for i in range(-1, len(polygon) - 1):
+        lon1, lat1 = polygon[i][0], polygon[i][1]
+        lon2, lat2 = polygon[i + 1][0], polygon[i + 1][1]
+
+        y1 = np.searchsorted(rows_lat[:, 0], min(lat1, lat2), side='left')
+        y2 = np.searchsorted(rows_lat[:, 0], max(lat1, lat2), side='right')
+        x2 = np.searchsorted(rows_lon[0], max(lon1, lon2), side='right')
+        if y1 >= y2 or x2 == 0:
+            continue
+
+        intersec[y1:y2, :x2] += check_edge_intersection(rows_lat[y1:y2, :x2], rows_lon[y1:y2, :x2], lon1, lat1, lon2, lat2)
 
-def check_intersection(line1: dict, line2: dict) -> bool:
+    return (intersec % 2 == 1).ravel()
+
+def check_edge_intersection(lat: np.ndarray, lon: np.ndarray, lon1: float, lat1: float, lon2: float, lat2: float) -> np.ndarray:
     """
-    Check if line1 and line2 intersects.
+    Check which rays from the points to their right intersect a polygon edge.
     """
-    if line2['p1']['lon'] == line2['p2']['lon']:
-        a2 = MAX_NUM
+    if lon1 == lon2:
+        a = MAX_NUM
     else:
-        a2 = (line2['p1']['lat'] - line2['p2']['lat']) / (line2['p1']['lon'] - line2['p2']['lon'])
-    b1 = -1
-    b2 = -1
-    c1 = line1['p1']['lat']
-    c2 = line2['p1']['lat'] - a2 * line2['p1']['lon']
-    
-    f1_1 = sign(b1 * line2['p1']['lat'] + c1)
-    f1_2 = sign(b1 * line2['p2']['lat'] + c1)
-    f2_1 = sign(a2 * line1['p1']['lon'] + b2 * line1['p1']['lat'] + c2)
-    f2_2 = sign(a2 * line1['p2']['lon'] + b2 * line1['p2']['lat'] + c2)
+        a = (lat1 - lat2) / (lon1 - lon2)
+    c = lat1 - a * lon1
 
-    return f1_1 != f1_2 and f2_1 != f2_2
+    f1_1 = np.sign(-lat1 + lat)
+    f1_2 = np.sign(-lat2 + lat)
+    f2_1 = np.sign(a * lon + -lat + c)
+    f2_2 = np.sign(a * (lon + 180) + -lat + c)
+    return (f1_1 != f1_2) & (f2_1 != f2_2)
 
 def add_pois(grid: dict, pois: list):
     """
@@ -396,30 +449,20 @@ def add_path(grid: dict, path: list, path_name: str):
     path_points = f'{path_name}_points'
     path_ids = f'{path_name}s'
 
-    for point in path:
-        # Ignore points outside the grid
-        if point['start']['lat'] < grid['bottom'] or point['start']['lat'] > grid['top'] \
-           or point['end']['lat'] < grid['bottom'] or point['end']['lat'] > grid['top'] \
-           or point['start']['lon'] < grid['left'] or point['start']['lon'] > grid['right'] \
-           or point['end']['lon'] < grid['left'] or point['end']['lon'] > grid['right']:
-           continue
-
-        a = coordinates_to_id(grid, point['start']['lat'], point['start']['lon'])
-        b = coordinates_to_id(grid, point['end']['lat'], point['end']['lon'])
+    # Start and end zones of every segment of the path
+    coordinates = np.array([(point['start']['lat'], point['start']['lon'], point['end']['lat'], point['end']['lon']) for point in path], dtype=np.float64).reshape(-1, 4)
+    start_lat, start_lon, end_lat, end_lon = coordinates.T
 
-        if a < 0 or b < 0 or a >= len(grid['zones']) or b >= len(grid['zones']):
-            continue
-        
-        # Select the movement approach
-        dist_x = b % grid['grid_x'] - a % grid['grid_x']
-        dist_y = int(b / grid['grid_x']) - int(a / grid['grid_x'])
+    # Ignore points outside the grid
+    valid = (start_lat >= grid['bottom']) & (start_lat <= grid['top']) & (end_lat >= grid['bottom']) & (end_lat <= grid['top']) & \
+            (start_lon >= grid['left']) & (start_lon <= grid['right']) & (end_lon >= grid['left']) & (end_lon <= grid['right'])
 
-        if abs(dist_x) >= abs(dist_y):
-            move_zones_x(grid, a, b, dist_x, dist_y, path_key)
-        else:
-            move_zones_y(grid, a, b, dist_x, dist_y, path_key)
+    starts = coordinates_to_id(grid, start_lat, start_lon)
+    ends = coordinates_to_id(grid, end_lat, end_lon)
+    valid &= (starts >= 0) & (ends >= 0) & (starts < len(grid['zones'])) & (ends < len(grid['zones']))
 
-        grid['zones'][a][path_key] = grid['zones'][b][path_key] = True
+    for id in trace_zones(grid, starts[valid], ends[valid]).tolist():
+        grid['zones'][id][path_key] = True
     
     # Count path zones
     for zone in grid['zones']:
@@ -429,99 +472,45 @@ def add_path(grid: dict, path: list, path_name: str):
     
     print('Done!')
 
-def coordinates_to_id(grid: dict, lat, lon):
+def coordinates_to_id(grid: dict, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
     """
-    Calculate the zone ID from its coordinates.
+    Calculate the zones IDs from arrays of coordinates.
     """
-    prop_x = (lon - grid['left']) / abs(grid['width'])
-    prop_y = (lat - grid['bottom']) / abs(grid['height'])
-    pos_x = int(prop_x * grid['grid_x'])
-    pos_y = int(prop_y * grid['grid_y'])
+    pos_x, pos_y = coordinates_to_position(grid, lat, lon)
     return pos_y * grid['grid_x'] + pos_x
 
-def move_zones_x(grid: dict, a: dict, b: dict, dist_x: int, dist_y: int, path_key: str):
+def coordinates_to_position(grid: dict, lat: np.ndarray, lon: np.ndarray) -> tuple:
     """
-    Move through path in X axis
+    Calculate the zones positions in the grid from arrays of coordinates.
     """
-    if dist_x == 0:
-        return
+    prop_x = (lon - grid['left']) / abs(grid['width'])
+    prop_y = (lat - grid['bottom']) / abs(grid['height'])
+    pos_x = np.trunc(prop_x * grid['grid_x']).astype(np.int64)
+    pos_y = np.trunc(prop_y * grid['grid_y']).astype(np.int64)
+    return pos_x, pos_y
 
-    # Calculate movement steps
-    if dist_y > 0:
-        step_y = (dist_y + 1) / (abs(dist_x) + 1)
-    else:
-        step_y = (dist_y - 1) / (abs(dist_x) + 1)
-    delta_y = 0.0
-    id = a
-    num_x = int(dist_x / abs(dist_x))
-    if dist_y != 0:
-        num_y = grid['grid_x'] * (int(dist_y / abs(dist_y)))
-    else:
-        num_y = 0
-    
-    # While getting near to the destination zone, keep moving.
-    # If we start to get far, stop!
-    prev_dist = dist = utils.__calculate_distance(grid['zones'][id], grid['zones'][b])
-    while dist <= prev_dist:
-        id += num_x
-        delta_y = delta_y + step_y
-        if abs(delta_y) >= 1:
-            id += num_y
-            delta_y -= int(delta_y / abs(delta_y))
-
-        if id < 0 or id > len(grid['zones']):
-            break
-
-        try:
-            grid['zones'][id][path_key] = True
-
-            # Update distance
-            prev_dist = dist
-            dist = utils.__calculate_distance(grid['zones'][id], grid['zones'][b])
-        except IndexError:
-            break
-    
-def move_zones_y(grid: dict, a: dict, b: dict, dist_x: int, dist_y: int, path_key: str):
+def trace_zones(grid: dict, a: np.ndarray, b: np.ndarray) -> np.ndarray:
     """
-    Move through path in Y axis
+    Get the IDs of the zones crossed by the lines from zones a to zones b,
+    sampling each line once per zone along its longest axis (DDA).
     """
-    if dist_y == 0:
-        return
+    if len(a) == 0:
+        return np.zeros(0, dtype=np.int64)
 
-    # Calculate movement steps
-    if dist_x > 0:
-        step_x = (dist_x + 1) / (abs(dist_y) + 1)
-    else:
-        step_x = (dist_x - 1) / (abs(dist_y) + 1)
-    delta_x = 0.0
-    id = a
-    if dist_x != 0:
-        num_x = int(dist_x / abs(dist_x))
-    else:
-        num_x = 0
-    num_y = grid['grid_x'] * (int(dist_y / abs(dist_y)))
-
-    # While getting near to the destination zone, keep moving.
-    # If we start to get far, stop!
-    prev_dist = dist = utils.__calculate_distance(grid['zones'][id], grid['zones'][b])
-    while dist <= prev_dist:
-        id += num_y
-        delta_x = delta_x + step_x
-        if abs(delta_x) >= 1:
-            id += num_x
-            delta_x -= int(delta_x / abs(delta_x))
-        
-        if id < 0 or id > len(grid['zones']):
-            break
+    ay, ax = np.divmod(a, grid['grid_x'])
+    by, bx = np.divmod(b, grid['grid_x'])
+    dist_x = bx - ax
+    dist_y = by - ay
 
-        try:
-            grid['zones'][id][path_key] = True
+    # Number of zones of each line and the step of each zone along it
+    steps = np.maximum(np.abs(dist_x), np.abs(dist_y)) + 1
+    line = np.repeat(np.arange(len(a)), steps)
+    step = np.arange(len(line)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = step / np.maximum(steps - 1, 1)[line]
 
-            # Update distance
-            prev_dist = dist
-            dist = utils.__calculate_distance(grid['zones'][id], grid['zones'][b])
-        except IndexError:
-            break
+    xs = np.rint(ax[line] + t * dist_x[line]).astype(np.int64)
+    ys = np.rint(ay[line] + t * dist_y[line]).astype(np.int64)
+    return np.unique(ys * grid['grid_x'] + xs)
 
 def calculate_pois_coverage_by_traveltime(grid: dict, max_time: int):
     """
@@ -532,19 +521,10 @@ def calculate_pois_coverage_by_traveltime(grid: dict, max_time: int):
     for poi in grid['pois_inside']:
         polygons = mapbox.get_traveltime(poi['lat'], poi['lon'], max_time)
         poi['coverage'] = polygons
+        poi['coverage_mbr'] = [get_polygon_mbr(polygon) for polygon in polygons]
 
     print('Done!')
 
-def check_zone_within_poi_coverage(zone: dict, poi: dict) -> bool:
-    """
-    Check if a zone is within a PoI's coverage.
-    """
-    # Don't check if there is no coverage information
-    if 'coverage' not in poi.keys():
-        return True
-
-    return check_zone_in_polygons_set(zone, poi['coverage'])
-
 def calculate_risk_from_pois(grid: dict):
     """
     Calculate the risk perception considering all PoIs.
@@ -554,39 +534,90 @@ def calculate_risk_from_pois(grid: dict):
 
     print(f'Calculating risk perception... ', end='')
 
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for id in grid['zones_inside']:
-            payload.append((grid, grid['zones'][id], grid['pois_inside']))
-        risks = pool.starmap(calculate_risk_of_zone, payload)
+    # Process the zones in blocks, so the arrays of a block stay in the CPU
+    # cache while all PoIs are applied to it
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    mitigation = np.zeros(len(ids), dtype=np.float64)
+    for start in range(0, len(ids), ZONES_BLOCK_SIZE):
+        end = start + ZONES_BLOCK_SIZE
+        mitigation[start:end] = calculate_mitigation_of_zones(grid, ids[start:end], grid['pois_inside'])
 
-    for risk in risks:
-        grid['zones'][risk[0]]['risk'] = risk[1]
+    for id, zone_mitigation in zip(ids.tolist(), mitigation.tolist()):
+        grid['zones'][id]['risk'] = 1 / zone_mitigation if zone_mitigation > 0 else None
 
     print('Done!')
 
-def calculate_risk_of_zone(grid: dict, zone: dict, pois: list) -> float:
+def calculate_mitigation_of_zones(grid: dict, ids: np.ndarray, pois: list) -> np.ndarray:
     """
-    Calculate the risk perception considering all PoIs.
+    Calculate the risk mitigation of the zones with the given ids considering
+    all PoIs. Each PoI is applied to all zones at once, in the PoIs order.
     """
-    mitigation = 0
+    z_lat = grid['zones_lat'][ids]
+    z_lon = grid['zones_lon'][ids]
+    z_cos_lat = grid['zones_cos_lat'][ids]
+    mitigation = np.zeros(len(ids), dtype=np.float64)
+    bad_pois = []
 
     for poi in pois:
-        if not check_zone_within_poi_coverage(zone, poi):
-            continue
-
         # Do not consider drought PoIs
         if poi['zone_id'] != None and grid['zones'][poi['zone_id']]['risk_river'] > 0:
             continue
 
-        if poi['badpoi'] == False:
-            # Good PoI. The nearer the better.
-            mitigation += poi['weight'] / (utils.__calculate_distance(zone, poi) ** 2)
-        else:
-            # Bad PoI. The nearer the worse.
-            mitigation += (utils.__calculate_distance(zone, poi) ** 2) / poi['weight']
+        # Bad PoIs applying to all zones are summed up at once later
+        if poi['badpoi'] != False and 'coverage' not in poi.keys():
+            bad_pois.append(poi)
+            continue
+
+        cos_lat = (z_cos_lat + math.cos(math.radians(poi['lat']))) / 2
+        dist = utils.__calculate_distance_flat(z_lat, z_lon, poi['lat'], poi['lon'], cos_lat)
+        with np.errstate(divide='ignore'):
+            if poi['badpoi'] == False:
+                # Good PoI. The nearer the better.
+                value = poi['weight'] / (dist ** 2)
+            else:
+                # Bad PoI. The nearer the worse.
+                value = (dist ** 2) / poi['weight']
+
+        # Only zones within the PoI's coverage, if known
+        if 'coverage' in poi.keys():
+            covered = check_points_in_polygons_set(z_lat, z_lon, poi['coverage'], poi.get('coverage_mbr'))
+            value = np.where(covered, value, 0)
+
+        mitigation += value
+
+    if len(bad_pois) > 0:
+        mitigation += calculate_mitigation_of_bad_pois(grid, z_lat, z_lon, z_cos_lat, bad_pois)
 
-    return (zone['id'], 1 / mitigation) if mitigation > 0 else (zone['id'], None)
+    return mitigation
+
+def calculate_mitigation_of_bad_pois(grid: dict, z_lat: np.ndarray, z_lon: np.ndarray, z_cos_lat: np.ndarray, pois: list) -> np.ndarray:
+    """
+    Calculate the risk mitigation of the zones considering bad PoIs. The value
+    of a bad PoI is the squared distance to the zone divided by its weight,
+    so the sum over all PoIs expands into a few sums over the PoIs that don't
+    depend on the zone, and the zones are computed once instead of once per PoI.
+    """
+    # Coordinates relative to the grid center, to keep the expanded terms small
+    lat0 = (grid['top'] + grid['bottom']) / 2
+    lon0 = (grid['left'] + grid['right']) / 2
+    p_lat = np.fromiter((poi['lat'] for poi in pois), dtype=np.float64, count=len(pois))
+    p_lon = np.fromiter((poi['lon'] for poi in pois), dtype=np.float64, count=len(pois))
+    p_weight = np.fromiter((poi['weight'] for poi in pois), dtype=np.float64, count=len(pois))
+    p_cos_lat = np.cos(np.radians(p_lat))
+    x, y = z_lon - lon0, z_lat - lat0
+    X, Y = p_lon - lon0, p_lat - lat0
+
+    # Longitude term: sum of ((x - X) * (c + C) / 2) ** 2 / w, where c and C are
+    # the cosines of the zone and PoI latitudes, expanded in powers of X and C
+    moments = np.array([[np.sum(X ** k * p_cos_lat ** m / p_weight) for m in range(3)] for k in range(3)])
+    a = np.array([x ** 2, -2 * x, np.ones_like(x)])
+    b = np.array([z_cos_lat ** 2, 2 * z_cos_lat, np.ones_like(z_cos_lat)])
+    lon_term = np.einsum('kn,km,mn->n', a, moments, b) / 4
+
+    # Latitude term: sum of (y - Y) ** 2 / w
+    lat_term = y ** 2 * np.sum(1 / p_weight) - 2 * y * np.sum(Y / p_weight) + np.sum(Y ** 2 / p_weight)
+
+    return utils.METERS_PER_DEGREE ** 2 * (lon_term + lat_term)
 
 def calculate_risk_from_elevation(grid: dict):
     """
@@ -598,24 +629,13 @@ def calculate_risk_from_elevation(grid: dict):
     print(f'Calculating risk from elevation... ', end='')
 
     normalize_elevation(grid)
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for id in grid['zones_inside']:
-            payload.append((grid['zones'][id],))
-        risks = pool.starmap(calculate_risk_of_zone_elevation, payload)
-    
-    for risk in risks:
-        grid['zones'][risk[0]]['risk_elevation'] = risk[1]
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    elevation_normalized = utils.__get_zones_column(grid, 'elevation_normalized', ids)
+    slope = utils.__get_zones_column(grid, 'slope', ids)
+    utils.__set_zones_column(grid, 'risk_elevation', np.exp(-(elevation_normalized + slope)), ids)
 
     print('Done!')
 
-def calculate_risk_of_zone_elevation(zone: dict) -> float:
-    """
-    Calculate the risk perception considering the zone elevation.
-    """
-    H = 1 / (math.e ** (zone['elevation_normalized']) * (math.e ** zone['slope']))
-    return (zone['id'], H)
-
 def calculate_risk_from_rivers(grid: dict):
     """
     Calculate the risk perception considering the zones distance from a river.
@@ -626,31 +646,39 @@ def calculate_risk_from_rivers(grid: dict):
     print(f'Calculating risk from rivers distance... ', end='')
 
     normalize_rivers_dist(grid)
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for id in grid['zones_inside']:
-            payload.append((grid, grid['zones'][id], grid['flood_level']))
-        risks = pool.starmap(calculate_risk_of_zone_from_rivers, payload)
-    
-    for risk in risks:
-        grid['zones'][risk[0]]['risk_river'] = risk[1]
+
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    risk = np.zeros(len(ids), dtype=np.float64)
+    if len(grid['rivers']) > 0:
+        # Process the zones in blocks to bound the size of the zones x rivers matrices
+        block = max(1, ZONES_BLOCK_SIZE // len(grid['rivers']))
+        for start in range(0, len(ids), block):
+            end = start + block
+            risk[start:end] = calculate_risk_of_zones_from_rivers(grid, ids[start:end], grid['flood_level'])
+
+    utils.__set_zones_column(grid, 'risk_river', risk, ids)
 
     print('Done!')
 
-def calculate_risk_of_zone_from_rivers(grid: dict, zone: dict, flood_level: float) -> float:
+def calculate_risk_of_zones_from_rivers(grid: dict, ids: np.ndarray, flood_level: float) -> np.ndarray:
     """
-    Calculate the risk perception considering the proximity of a zone to a river.
+    Calculate the risk perception considering the proximity of the zones with
+    the given ids to a river.
     """
-    risk = 0
-    for id in grid['rivers']:
-        river = grid['zones'][id]
-        if zone['elevation'] - river['elevation'] > flood_level:
-            continue
-        dist = utils.__calculate_distance(zone, river)
-        R = 1 / math.e ** ((math.e ** 4) * (dist / grid['river_dist_max']))
-        risk = max(risk, R)
-    
-    return (zone['id'], risk)
+    z_lat = grid['zones_lat'][ids][:, None]
+    z_lon = grid['zones_lon'][ids][:, None]
+    z_elevation = utils.__get_zones_column(grid, 'elevation', ids)[:, None]
+    r_lat = grid['zones_lat'][grid['rivers']][None, :]
+    r_lon = grid['zones_lon'][grid['rivers']][None, :]
+    r_elevation = utils.__get_zones_column(grid, 'elevation', grid['rivers'])[None, :]
+
+    cos_lat = (grid['zones_cos_lat'][ids][:, None] + grid['zones_cos_lat'][grid['rivers']][None, :]) / 2
+    dist = utils.__calculate_distance_flat(z_lat, z_lon, r_lat, r_lon, cos_lat)
+    R = np.exp(-(math.e ** 4) * (dist / grid['river_dist_max']))
+
+    # Rivers below the zone by more than the flood level don't add risk
+    R[z_elevation - r_elevation > flood_level] = 0
+    return R.max(axis=1)
 
 def normalize_risks(grid: dict):
     """
@@ -658,24 +686,17 @@ def normalize_risks(grid: dict):
     """
     print(f'Normalizing risks... ', end='')
 
-    min_risk = 999999999999
-    max_risk = 0
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    risk = np.fromiter((np.nan if grid['zones'][id]['risk'] == None else grid['zones'][id]['risk'] for id in ids.tolist()), dtype=np.float64, count=len(ids))
+    known = ~np.isnan(risk)
 
-    for id in grid['zones_inside']:
-        if grid['zones'][id]['risk'] == None:
-            continue
-
-        min_risk = min(min_risk, grid['zones'][id]['risk'])
-        max_risk = max(max_risk, grid['zones'][id]['risk'])
+    min_risk = min(999999999999, risk[known].min()) if known.any() else 999999999999
+    max_risk = max(0, risk[known].max()) if known.any() else 0
 
     amplitude = max_risk - min_risk
     amplitude = 1 if amplitude == 0 else amplitude
 
-    for id in grid['zones_inside']:
-        if grid['zones'][id]['risk'] == None:
-            grid['zones'][id]['risk'] = 1
-        else:
-            grid['zones'][id]['risk'] = (grid['zones'][id]['risk'] - min_risk) / amplitude
+    utils.__set_zones_column(grid, 'risk', np.where(known, (risk - min_risk) / amplitude, 1), ids)
 
     print('Done!')
 
@@ -683,26 +704,21 @@ def normalize_elevation(grid: dict):
     """
     Normalize elevation values in zones.
     """
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    elevation = utils.__get_zones_column(grid, 'elevation', ids)
 
     # Get max and min values
     hmax = hmin = grid['zones'][0]['elevation']
-    for id in grid['zones_inside']:
-        zone = grid['zones'][id]
-
-        if zone['elevation'] > hmax:
-            hmax = zone['elevation']
-
-        if zone['elevation'] < hmin:
-            hmin = zone['elevation']
+    if len(elevation) > 0:
+        hmax = max(hmax, elevation.max())
+        hmin = min(hmin, elevation.min())
     
     # Middle value
     m = (hmax - hmin) / 2 + hmin
     m_top = hmax - m if hmax != m else 0.1
 
     # Normalization
-    for id in grid['zones_inside']:
-        zone = grid['zones'][id]
-        zone['elevation_normalized'] = (zone['elevation'] - m) / m_top
+    utils.__set_zones_column(grid, 'elevation_normalized', (elevation - m) / m_top, ids)
 
     print(f'hmax={hmax}, hmin={hmin}, m={m}, m_top={m_top}')
 
@@ -710,100 +726,72 @@ def normalize_rivers_dist(grid: dict):
     """
     Normalize the distances to rivers values.
     """
-    maxdist_all = 0
+    if len(grid['rivers']) == 0:
+        grid['river_dist_max'] = 0
+        return
 
-    # Compute distance to rivers
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for id in grid['zones_inside']:
-            payload.append((grid, grid['zones'][id]))
-        dists = pool.starmap(calculate_distance_of_zone_to_river, payload)
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
 
-    for dist in dists:
-        grid['zones'][dist[0]]['river_dist'] = dist[1]
+    # Compute distance to rivers. It is the distance to the last river zone.
+    river = grid['rivers'][-1]
+    dists = utils.__calculate_distance_vec(grid['zones_lat'][ids], grid['zones_lon'][ids], grid['zones_lat'][river], grid['zones_lon'][river])
+    utils.__set_zones_column(grid, 'river_dist', dists, ids)
 
     # Normalize distances
-    for id in grid['zones_inside']:
-        zone = grid['zones'][id]
-        maxdist_all = max(maxdist_all, zone['river_dist'])
-
-    for id in grid['zones_inside']:
-        grid['zones'][id]['river_dist_normalized'] = grid['zones'][id]['river_dist'] / maxdist_all
+    maxdist_all = max(0, dists.max()) if len(dists) > 0 else 0
+    utils.__set_zones_column(grid, 'river_dist_normalized', dists / maxdist_all, ids)
 
     grid['river_dist_max'] = maxdist_all
 
-def calculate_distance_of_zone_to_river(grid: dict, zone: dict) -> list:
-    maxdist = 0
-    for river_id in grid['rivers']:
-        river = grid['zones'][river_id]
-        dist = utils.__calculate_distance(zone, river)
-        maxdist = max(maxdist, dist)
-
-    return (zone['id'], dist)
-
 def calculate_RL(grid: dict):
     """
     Calculate the RL according to risk perception.
     """
-    for id in grid['zones_inside']:
-        if grid['zones'][id]['risk'] == 0:
-            grid['zones'][id]['RL'] = 1
-        else:
-            combined_risk = grid['zones'][id]['risk']
-            
-            if 'risk_elevation' in grid['zones'][id].keys():
-                combined_risk *= grid['zones'][id]['risk_elevation']
-            
-            if 'risk_river' in grid['zones'][id].keys():
-                combined_risk += grid['zones'][id]['risk_river']
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    zones = [grid['zones'][id] for id in ids.tolist()]
+    risk = np.fromiter((zone['risk'] for zone in zones), dtype=np.float64, count=len(zones))
+    risk_elevation = np.fromiter((zone.get('risk_elevation', 1) for zone in zones), dtype=np.float64, count=len(zones))
+    risk_river = np.fromiter((zone.get('risk_river', 0) for zone in zones), dtype=np.float64, count=len(zones))
 
-            if combined_risk <= 0:
-                rl = grid['M'] - 1
-            else:
-                rl = grid['M'] - min(abs(int(math.log(combined_risk))), grid['M'] - 1)
-            
-            grid['zones'][id]['RL'] = int(rl)
+    combined_risk = risk * risk_elevation + risk_river
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rl = grid['M'] - np.minimum(np.abs(np.trunc(np.log(combined_risk))), grid['M'] - 1)
+    rl = np.where(combined_risk <= 0, grid['M'] - 1, rl)
+    rl = np.where(risk == 0, 1, rl)
+
+    for zone, zone_rl in zip(zones, rl.astype(np.int64).tolist()):
+        zone['RL'] = zone_rl
 
 def get_number_of_zones_by_RL(grid: dict) -> dict:
     """
     Calculate the number of zones by RL.
     """
-    nzones = {}
-    for i in range(1, grid['M'] + 1):
-        nzones[i] = 0
-    
-    for id in grid['zones_inside']:
-        nzones[grid['zones'][id]['RL']] += 1
-    
-    return nzones
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    return count_zones_by_RL(grid, ids)
 
 def get_number_of_roads_by_RL(grid: dict, connectivity_threshold: int = 0) -> dict:
     """
     Calculate the number of zones on roads by RL.
     """
-    nzones = {}
-    for i in range(1, grid['M'] + 1):
-        nzones[i] = 0
-    
-    for id in grid['zones_inside']:
-        if grid['zones'][id]['is_road']:
-            nzones[grid['zones'][id]['RL']] += 1
-    
-    return nzones
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    is_road = utils.__get_zones_column(grid, 'is_road', ids).astype(bool)
+    return count_zones_by_RL(grid, ids[is_road])
 
 def get_urban_area_by_RL(grid: dict) -> dict:
     """
     Calculate the number of zones with at least 50% probability of being in an urban area.
     """
-    nzones = {}
-    for i in range(1, grid['M'] + 1):
-        nzones[i] = 0
-    
-    for id in grid['zones_inside']:
-        if grid['zones'][id]['urban_prob'] >= 0.5:
-            nzones[grid['zones'][id]['RL']] += 1
-    
-    return nzones
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    urban = utils.__get_zones_column(grid, 'urban_prob', ids) >= 0.5
+    return count_zones_by_RL(grid, ids[urban])
+
+def count_zones_by_RL(grid: dict, ids: np.ndarray) -> dict:
+    """
+    Count the zones with the given ids by RL.
+    """
+    RL = utils.__get_zones_column(grid, 'RL', ids).astype(np.int64)
+    counts = np.bincount(RL, minlength=grid['M'] + 1)
+    return {i: int(counts[i]) for i in range(1, grid['M'] + 1)}
 
 def get_number_of_edus_by_RL(grid: dict, n_edus: int, use_roads=False, connectivity_threshold: int = 0) -> dict:
     """
@@ -856,63 +844,50 @@ def set_area_urban_probability(grid: dict):
     """
     Search the whole grid area and calculate the urban probability of each zone by its surroudings roads.
     """
-    for zone in grid['zones']:
-        zone['urban_prob'] = 0
-    
     # The reducing_factor defines how much % the next zone will loose in urban probability
     # comparing to the preivous zone. Considering quarters of an 100 meters wide average,
     # the reducing_factor will be of 0.5% per meter.
     reducing_factor = grid['zone_size'] / 200
 
-    # Left to right
-    for y in range(grid['grid_y']):
-        prob = 0
-        for x in range(grid['grid_x']):
-            id = grid['grid_x'] * y + x
-            prob = set_zone_urban_probability(grid['zones'][id], prob, reducing_factor)
-
-    # Right to left
-    for y in range(grid['grid_y']):
-        prob = 0
-        for x in range(grid['grid_x'] - 1, -1, -1):
-            id = grid['grid_x'] * y + x
-            prob = set_zone_urban_probability(grid['zones'][id], prob, reducing_factor)
-
-    # Bottom up
-    for x in range(grid['grid_x']):
-        prob = 0
-        for y in range(grid['grid_y']):
-            id = grid['grid_x'] * y + x
-            prob = set_zone_urban_probability(grid['zones'][id], prob, reducing_factor)
-
-    # Top down
-    for x in range(grid['grid_x']):
-        prob = 0
-        for y in range(grid['grid_y'] - 1, -1, -1):
-            id = grid['grid_x'] * y + x
-            prob = set_zone_urban_probability(grid['zones'][id], prob, reducing_factor)
-
-def set_zone_urban_probability(zone: dict, prob: float, reducing_factor: float):
-    """
-    Set zone's urban probability and return the value for the next zone based on reducing_factor.
-    """
-    if zone['is_road']:
-        prob = 1
-    
-    zone['urban_prob'] = max(zone['urban_prob'], prob)
-    return max(prob - reducing_factor, 0)  # Can't have negative probabilities
+    # Urban probability of a zone by its distance in zones to a road
+    decay = [1.0]
+    for i in range(max(grid['grid_x'], grid['grid_y'])):
+        decay.append(max(decay[-1] - reducing_factor, 0))  # Can't have negative probabilities
+    decay = np.array(decay)
+
+    roads = utils.__get_zones_column(grid, 'is_road').astype(bool).reshape(grid['grid_y'], grid['grid_x'])
+    prob = np.zeros(roads.shape, dtype=np.float64)
+
+    # Left to right, right to left, bottom up and top down
+    prob = np.maximum(prob, get_urban_probability_along_rows(roads, decay))
+    prob = np.maximum(prob, get_urban_probability_along_rows(roads[:, ::-1], decay)[:, ::-1])
+    prob = np.maximum(prob, get_urban_probability_along_rows(roads.T, decay).T)
+    prob = np.maximum(prob, get_urban_probability_along_rows(roads.T[:, ::-1], decay)[:, ::-1].T)
+
+    utils.__set_zones_column(grid, 'urban_prob', prob.ravel())
+
+def get_urban_probability_along_rows(roads: np.ndarray, decay: np.ndarray) -> np.ndarray:
+    """
+    Calculate the urban probability of each zone by the distance to the last
+    road before it in its row.
+    """
+    pos = np.arange(roads.shape[1])
+    last_road = np.maximum.accumulate(np.where(roads, pos, -1), axis=1)
+    return np.where(last_road >= 0, decay[pos - last_road], 0)
 
 def set_edus_positions_random(grid: dict):
     """
     Randomly select zones for EDUs positioning.
     """
-    random.seed()
-    zones_by_RL = get_zones_by_RL(grid)
+    rng = np.random.default_rng()
+    ids = np.array(grid['zones_inside'], dtype=np.int64)
+    RL = utils.__get_zones_column(grid, 'RL', ids)
     grid['edus'] = {}
     edus = get_number_of_edus_by_RL(grid, grid['n_edus_loose'] + grid['n_edus_tight'])
     
     for i in range(1, grid['M'] + 1):
-        grid['edus'][i] = random.choices(zones_by_RL[i], k=edus[i])
+        edus_ids = rng.choice(ids[RL == i], size=edus[i])
+        grid['edus'][i] = [grid['zones'][id] for id in edus_ids.tolist()]
 
 def reset_edus_flag(grid: dict, n_edus=None):
     """
@@ -937,35 +912,37 @@ def reset_edus_data(grid: dict, n_edus=None, use_roads=False, connectivity_thres
     grid['Ax'] = {}
     grid['radius'] = {}
     grid['step'] = {}
-    grid['step_x'] = {}
-    grid['step_y'] = {}
-    grid['zone_in_y'] = {}
     grid['min_dist'] = {}
+    grid['radius_sq'] = {}
+    grid['min_dist_sq'] = {}
+
+    if use_roads:
+        set_area_urban_probability(grid)
+        area_by_RL = get_urban_area_by_RL(grid)
+    else:
+        area_by_RL = get_number_of_zones_by_RL(grid)
 
     for i in range(1, grid['M'] + 1):
         if edus[i] == 0:
             edus[i] = 1
-        if use_roads:
-            set_area_urban_probability(grid)
-            grid['At'][i] = get_urban_area_by_RL(grid)[i]               # Urban area of the whole RL
-        else:
-            grid['At'][i] = get_number_of_zones_by_RL(grid)[i]          # Area of the whole RL
+        grid['At'][i] = area_by_RL[i]                                   # Area (or urban area) of the whole RL
         grid['Ax'][i] = round(grid['At'][i] / edus[i])                  # Coverage area of an EDU
         grid['radius'][i] = max(math.sqrt(grid['Ax'][i]) / 2, 1)        # Radius of an EDU
         grid['step'][i] = int(2 * grid['radius'][i] + 1)                # Step distance on x and y directions
-        grid['step_x'][i] = grid['step_y'][i] = 0                       # The steps are accounted individually for each RL
-        grid['zone_in_y'][i] = False                                    # To check if there was any zone for a RL in any y
         grid['min_dist'][i] = 2 * grid['radius'][i] + 1                 # Minimum distance an EDU must have from another in this RL
+
+        # Limits of the squared distances in the grid within radius + 1 and below min_dist
+        grid['radius_sq'][i] = utils.__get_distance_sq_limit(math.nextafter(grid['radius'][i] + 1, math.inf))
+        grid['min_dist_sq'][i] = utils.__get_distance_sq_limit(grid['min_dist'][i])
     grid['smallest_radius'] = grid['radius'][grid['M']]                 # Radius of the highest level
     grid['highest_radius'] = grid['radius'][1]                          # Radius of the lowest level
     grid['search_range'] = -int(math.ceil(2 * grid['grid_x'] / grid['smallest_radius']))
+    grid['bucket_size'] = int(math.ceil(max(grid['min_dist'].values())))  # Size of the EDUs buckets, so near EDUs are in adjacent buckets
     
     # Make sure there are no 0 radius
     if grid['smallest_radius'] == 0: grid['smallest_radius'] = 1
     if grid['highest_radius'] == 0: grid['highest_radius'] = 1
 
-    grid['zones'].sort(key=lambda zone : zone['id'])
-
 def set_edus_positions_uniform(grid: dict, mode: int, connectivity_threshold: int = 0):
     """
     Uniformly select zones for EDUs positioning.
@@ -982,6 +959,10 @@ def set_edus_positions_uniform(grid: dict, mode: int, connectivity_threshold: in
     elif mode == RESTRICTED:
         set_edus_positions_uniform_restricted(grid)
     elif mode == RESTRICTED_PLUS:
+        # Zones without connectivity data have no connectivity
+        for zone in grid['zones']:
+            zone.setdefault('dpconn', 0)
+
         set_edus_positions_uniform_restricted_plus(grid, grid['n_edus_tight'], connectivity_threshold, EDU_TIGHT)
         set_edus_positions_uniform_restricted_plus(grid, grid['n_edus_loose'], 0, EDU_LOOSE)
     
@@ -992,81 +973,113 @@ def set_edus_positions_uniform_unbalanced(grid: dict):
     Unbalanced positioning mode.
     """
     print('Chosen positioning method: uniform unbalanced.')
-    for y in range(grid['grid_y']):
-        # First, reset step for every RL in x direction and check if there was any zone in y
-        for i in range(1, grid['M'] + 1):
-            grid['step_x'][i] = 0
-            if grid['zone_in_y'][i]:
-                grid['step_y'][i] += 1
-                grid['zone_in_y'][i] = False
-
-        # For each zone in this row, check if it is inside AoI and check if it is time to
-        # put an EDU in it
-        for x in range(grid['grid_x']):
-            id = grid['grid_x'] * y + x
-            zone = grid['zones'][id]
-            if not zone['inside']: continue
+    inside = utils.__get_zones_column(grid, 'inside').astype(bool).reshape(grid['grid_y'], grid['grid_x'])
+    RL = utils.__get_zones_column(grid, 'RL').reshape(grid['grid_y'], grid['grid_x'])
+
+    for i in range(1, grid['M'] + 1):
+        zones_RL = inside & (RL == i)
 
-            for i in range(1, grid['M'] + 1):
-                if zone['RL'] != i: continue
-                grid['zone_in_y'][i] = True  # If there was any zone for this RL in this y, we can increment step_y later
+        # The steps are accounted individually for each RL: step_x counts the
+        # zones of the RL before each zone in its row and step_y counts the
+        # previous rows with any zone of the RL
+        step_x = np.cumsum(zones_RL, axis=1) - 1
+        rows_RL = zones_RL.any(axis=1)
+        step_y = np.cumsum(rows_RL) - rows_RL
 
-                if grid['step_x'][i] % grid['step'][i] == 0 and grid['step_y'][i] % grid['step'][i] == 0:
-                    grid['edus'][i].append(zone)
-                    
-                grid['step_x'][i] += 1
+        # Put an EDU every step zones in x and y directions
+        edus = zones_RL & (step_x % grid['step'][i] == 0) & (step_y % grid['step'][i] == 0)[:, None]
+        grid['edus'][i].extend(grid['zones'][id] for id in np.flatnonzero(edus).tolist())
 
-                prog = (id / len(grid['zones'])) * 100
-                print(f'Positioning EDUs... {prog:.2f}%', end='\r')
+        prog = (i / grid['M']) * 100
+        print(f'Positioning EDUs... {prog:.2f}%', end='\r')
     
 def set_edus_positions_uniform_balanced(grid: dict):
     """
     Balanced positioning mode.
     """
     print('Chosen positioning method: uniform balanced.')
+    buckets = get_edus_buckets(grid)
+    allowed = utils.__get_zones_column(grid, 'inside').astype(bool)
+    next_allowed = get_next_allowed_zones(allowed)
+    n_zones = len(allowed)
     y = int(grid['smallest_radius'])
     while y < grid['grid_y']:
         x = 0
-        try:
-            while x < grid['grid_x']:
-                while True:
-                    # Get the zone in this coordinate by its ID
-                    id = grid['grid_x'] * y + x
-                    zone = grid['zones'][id]
-
-                    # The zone must be inside the AoI, otherwise, check the next zone
-                    if zone['inside']:
-                        break
-                    elif x >= grid['grid_x']:
-                        raise OutOfBounds
-                    else:
-                        x += 1
-
-                try:
-                    # Don't even try if we are still within the range of another EDU
-                    for i in range(1, grid['M'] + 1):
-                        for edu in grid['edus'][i][-1:grid['search_range']:-1]:
-                            dist = utils.__calculate_distance_in_grid(grid, zone, edu)
-                            if dist < grid['min_dist'][zone['RL']]:
-                                raise SkipZone
-
-                    zone['has_edu'] = True
-                    grid['edus'][zone['RL']].append(zone)
-                    x += int(grid['smallest_radius'] * 2)
-                
-                except SkipZone:
-                    x += 1
-            
-                prog = (id / len(grid['zones'])) * 100
-                print(f'Positioning EDUs... {prog:.2f}%', end='\r')
-
-        except IndexError:
-            pass
-        except OutOfBounds:
-            pass
-        
+        while x < grid['grid_x']:
+            # Get the next zone inside the AoI in this row by its ID. The first
+            # zone of the next row is checked too when the end of the row is reached.
+            row_start = grid['grid_x'] * y
+            id = next_allowed[row_start + x]
+            if id >= n_zones or id > row_start + grid['grid_x']:
+                break
+            x = id - row_start
+
+            # Don't even try if we are still within the range of another EDU
+            zone = grid['zones'][id]
+            if check_zone_near_edus(grid, buckets, zone):
+                x += 1
+                continue
+
+            add_edu_to_buckets(grid, buckets, zone)
+            zone['has_edu'] = True
+            grid['edus'][zone['RL']].append(zone)
+            x += int(grid['smallest_radius'] * 2)
+
+        # Print the progress every 1% of the rows
+        if y % max(1, grid['grid_y'] // 100) == 0:
+            prog = (y / grid['grid_y']) * 100
+            print(f'Positioning EDUs... {prog:.2f}%', end='\r')
         y += 1
 
+def get_next_allowed_zones(allowed: np.ndarray) -> list:
+    """
+    Get, for every zone id, the id of the first allowed zone from it onwards,
+    or the number of zones if there is none. The list has an extra entry for
+    the id past the last zone.
+    """
+    n_zones = len(allowed)
+    ids = np.where(allowed, np.arange(n_zones), n_zones)
+    return np.minimum.accumulate(np.append(ids, n_zones)[::-1])[::-1].tolist()
+
+def get_edus_buckets(grid: dict) -> dict:
+    """
+    Index the positioned EDUs by square buckets of zones, so the EDUs near a
+    zone are found in its bucket and in the adjacent ones. Each EDU is stored
+    as its RL, its index in the RL's EDUs list and its grid coordinates.
+    """
+    buckets = {}
+    for i in range(1, grid['M'] + 1):
+        for index, edu in enumerate(grid['edus'][i]):
+            y, x = divmod(edu['id'], grid['grid_x'])
+            buckets.setdefault((x // grid['bucket_size'], y // grid['bucket_size']), []).append((i, index, x, y))
+
+    return buckets
+
+def add_edu_to_buckets(grid: dict, buckets: dict, zone: dict):
+    """
+    Add a zone about to receive an EDU to the EDUs buckets.
+    """
+    y, x = divmod(zone['id'], grid['grid_x'])
+    buckets.setdefault((x // grid['bucket_size'], y // grid['bucket_size']), []).append((zone['RL'], len(grid['edus'][zone['RL']]), x, y))
+
+def check_zone_near_edus(grid: dict, buckets: dict, zone: dict) -> bool:
+    """
+    Check if a zone is within the minimum distance of another EDU. Only the
+    last EDUs positioned in each RL, within the search range, are considered.
+    """
+    zy, zx = divmod(zone['id'], grid['grid_x'])
+    bx = zx // grid['bucket_size']
+    by = zy // grid['bucket_size']
+    min_dist_sq = grid['min_dist_sq'][zone['RL']]
+    for key in ((bx + dx, by + dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)):
+        for i, index, x, y in buckets.get(key, ()):
+            if index <= len(grid['edus'][i]) + grid['search_range']:
+                continue
+            if (x - zx) ** 2 + (y - zy) ** 2 < min_dist_sq:
+                return True
+
+    return False
+
 def set_edus_positions_uniform_restricted(grid: dict):
     """
     Restricted positioning mode.
@@ -1081,6 +1094,9 @@ def set_edus_positions_uniform_restricted(grid: dict):
     edus_remaining = grid['n_edus_loose'] + grid['n_edus_tight'] - edus_total
     n_run = 0
 
+    # Zones where an EDU can be moved to
+    permitted = utils.__get_zones_column(grid, 'inside').astype(bool) & utils.__get_zones_column(grid, 'is_road').astype(bool)
+
     # Repeat until all EDUs are positioned
     while edus_remaining > 0:
         print(f"\n> Run #{n_run}, {edus_remaining} EDUs left.")
@@ -1094,52 +1110,59 @@ def set_edus_positions_uniform_restricted(grid: dict):
         # If not, move it to the nearest permitted zone.
         for i in range(1, grid['M'] + 1):
             zones_removal = []
+            offsets = np.cumsum(utils.__get_spiral_path(grid, grid['radius'][i]), dtype=np.int64)
+            final_ids = {zone['id'] for zone in final_edus[i]}
 
             for zone in grid['edus'][i]:
                 if zone['is_road']: continue
 
                 # Mark the zone for EDU removal (it is not a road)
-                zone_id = zone['id']
                 zones_removal.append(zone)
                 zone['has_edu'] = False
 
                 # Find another zone within the RL radius to place the EDU
-                spiral_path = utils.__get_spiral_path(grid, grid['radius'][i])
-                for step in spiral_path:
-                    zone_id += step
-                    try:
-                        nearby_zone = grid['zones'][zone_id]
-                        if utils.__calculate_distance_in_grid(grid, zone, nearby_zone) > grid['radius'][i] + 1: continue
-                        if not nearby_zone['inside']: continue
-                        if not nearby_zone['is_road']: continue
-                        if nearby_zone['has_edu']: continue
-                        if nearby_zone in final_edus[i]: continue
-
-                        nearby_zone['has_edu'] = True
-                        grid['edus'][i].append(nearby_zone)
-                        break
-                    except IndexError:
-                        continue
+                for nearby_id in get_spiral_candidates(grid, zone['id'], offsets, grid['radius_sq'][i], permitted).tolist():
+                    nearby_zone = grid['zones'][nearby_id]
+                    if nearby_zone['has_edu']: continue
+                    if nearby_id in final_ids: continue
+
+                    nearby_zone['has_edu'] = True
+                    grid['edus'][i].append(nearby_zone)
+                    break
         
             # Remove from grid['edus'] all zones that have been marked for removal
-            for zone in zones_removal:
-                grid['edus'][i].remove(zone)
+            removal_ids = {zone['id'] for zone in zones_removal}
+            grid['edus'][i] = [zone for zone in grid['edus'][i] if zone['id'] not in removal_ids]
             
-        # Move all the positioned EDUs to the final structure
+        # Move all the positioned EDUs to the final structure and update the total and remaining
         for i in range(1, grid['M'] + 1):
             final_edus[i].extend(grid['edus'][i])
+            edus_total += len(grid['edus'][i])
             grid['edus'][i] = []
-
-        # Recalculate the total and remaining
-        edus_total = 0
-        for i in range(1, grid['M'] + 1):
-            edus_total += len(final_edus[i])
         edus_remaining = grid['n_edus_loose'] + grid['n_edus_tight'] - edus_total
     
     # Positioning finished. Move final_edus to grid
     for i in range(1, grid['M'] + 1):
         grid['edus'][i] = [*final_edus[i]]
 
+def get_spiral_candidates(grid: dict, center_id: int, offsets: np.ndarray, max_dist_sq: int, permitted: np.ndarray) -> np.ndarray:
+    """
+    Get the ids of the permitted zones along a spiral path around a zone, in
+    the path order, skipping the ones whose squared distance from it is not
+    below max_dist_sq. The offsets are the cumulative steps of the path. As the
+    zones are searched by their index in the zones list, negative ids wrap
+    around to the end of it.
+    """
+    n_zones = len(grid['zones'])
+    ids = center_id + offsets
+    ids = ids[(ids >= -n_zones) & (ids < n_zones)] % n_zones
+
+    y, x = np.divmod(ids, grid['grid_x'])
+    cy, cx = divmod(center_id, grid['grid_x'])
+    dist_sq = (x - cx) ** 2 + (y - cy) ** 2
+
+    return ids[(dist_sq < max_dist_sq) & permitted[ids]]
+
 def set_edus_positions_uniform_restricted_plus(grid: dict, n_edus: int, connectivity_threshold: int = 0, edus_type: int = EDU_LOOSE):
     """
     Restricted+ positioning mode.
@@ -1157,92 +1180,72 @@ def set_edus_positions_uniform_restricted_plus(grid: dict, n_edus: int, connecti
         edu_positioned = False
         n_run += 1
         reset_edus_data(grid, n_edus * n_run, use_roads=True, connectivity_threshold=connectivity_threshold)
+        buckets = get_edus_buckets(grid)
+
+        # The zone must be inside the AoI, be a road, have some connectivity and
+        # not have an EDU yet
+        allowed = utils.__get_zones_column(grid, 'inside').astype(bool) & utils.__get_zones_column(grid, 'is_road').astype(bool) & \
+                  (utils.__get_zones_column(grid, 'dpconn') >= connectivity_threshold) & ~utils.__get_zones_column(grid, 'has_edu').astype(bool)
+        next_allowed = get_next_allowed_zones(allowed)
+        allowed = allowed.tolist()
+        n_zones = len(allowed)
+
         y = int(grid['smallest_radius'])
         while edus_remaining > 0 and y < grid['grid_y']:
             x = 0
-            try:
-                while edus_remaining > 0 and x < grid['grid_x']:
-                    while True:
-                        # Get the zone in this coordinate by its ID
-                        id = grid['grid_x'] * y + x
-                        zone = grid['zones'][id]
-                        if 'dpconn' not in zone.keys():
-                            zone['dpconn'] = 0
-
-                        # The zone must be inside the AoI, be a road and have some connectivity, otherwise, check the next zone
-                        if zone['inside'] and zone['is_road'] and zone['dpconn'] >= connectivity_threshold and not zone['has_edu']:
-                            break
-                        elif x >= grid['grid_x']:
-                            raise OutOfBounds
-                        else:
-                            x += 1
-
-                    try:
-                        # Don't even try if we are still within the range of another EDU
-                        for i in range(1, grid['M'] + 1):
-                            for edu in grid['edus'][i][-1:grid['search_range']:-1]:
-                                dist = utils.__calculate_distance_in_grid(grid, zone, edu)
-                                if dist < grid['min_dist'][zone['RL']]:
-                                    raise SkipZone
-
-                        zone['has_edu'] = True
-                        zone['edu_type'] = edus_type
-                        grid['edus'][zone['RL']].append(zone)
-                        edu_positioned = True
-                        edus_remaining -= 1
-                        edus_total += 1
-                        x += int(grid['smallest_radius'] * 2)
-                    
-                    except SkipZone:
-                        x += 1
-                
-                    prog = (id / len(grid['zones'])) * 100
-                    print(f'Positioning EDUs... {prog:.2f}%', end='\r')
-
-            except IndexError:
-                pass
-            except OutOfBounds:
-                pass
-            
+            while edus_remaining > 0 and x < grid['grid_x']:
+                # Get the next allowed zone in this row by its ID. The first zone
+                # of the next row is checked too when the end of the row is reached.
+                # Zones that got an EDU in this run are still in the index, so skip them.
+                row_start = grid['grid_x'] * y
+                id = next_allowed[row_start + x]
+                while id < n_zones and not allowed[id]:
+                    id = next_allowed[id + 1]
+                if id >= n_zones or id > row_start + grid['grid_x']:
+                    break
+                x = id - row_start
+
+                # Don't even try if we are still within the range of another EDU
+                zone = grid['zones'][id]
+                if check_zone_near_edus(grid, buckets, zone):
+                    x += 1
+                    continue
+
+                add_edu_to_buckets(grid, buckets, zone)
+                zone['has_edu'] = True
+                zone['edu_type'] = edus_type
+                allowed[id] = False
+                grid['edus'][zone['RL']].append(zone)
+                edu_positioned = True
+                edus_remaining -= 1
+                edus_total += 1
+                x += int(grid['smallest_radius'] * 2)
+
+            # Print the progress every 1% of the rows
+            if y % max(1, grid['grid_y'] // 100) == 0:
+                prog = (y / grid['grid_y']) * 100
+                print(f'Positioning EDUs... {prog:.2f}%', end='\r')
             y += 1
         
     print(f'\nPositioned {edus_total}/{n_edus} EDUs.')
 
 def get_zones_in_area(grid: dict, center_id: int, radius: int) -> list:
     """
-    Get all zones within a squared area.
+    Get all zones within a squared area, sorted by id.
     """
-    center_x = int(center_id % grid['grid_x'])
-    center_y = int(center_id / grid['grid_x'])
-    zones = []
-
-    for i in range(center_y - radius, center_y + radius + 1):
-        if i < 0: continue
-        if i >= grid['grid_y']: break
+    center_y, center_x = divmod(int(center_id), grid['grid_x'])
+    ys = np.arange(max(0, center_y - radius), min(grid['grid_y'], center_y + radius + 1))
+    xs = np.arange(max(0, center_x - radius), min(grid['grid_x'], center_x + radius + 1))
+    ids = (ys[:, None] * grid['grid_x'] + xs[None, :]).ravel()
 
-        for j in range(center_x - radius, center_x + radius + 1):
-            if j < 0: continue
-            if j >= grid['grid_x']: break
-
-            zones.append(grid['zones'][i * grid['grid_x'] + j])
-    
-    zones.sort(key=lambda zone : zone['id'])
-    return zones
+    return [grid['zones'][id] for id in ids.tolist()]
 
-if __name__ == '__main__':
+def main(config_filename: str):
     """
-    Main program.
+    Classify the zones and position the EDUs as described in a configuration file.
     """
-    if len(sys.argv) < 2:
-        print(f'Use: {sys.argv[0]} config.json\n')
-        print('config.json is a configuration file in JSON format. See examples in conf folder.')
-        sys.exit(EXIT_HELP)
-
-    # Python multiprocessing start method
-    mp.set_start_method('spawn')
-
     # Config file
-    fp = open(sys.argv[1], 'r')
+    fp = open(config_filename, 'r')
     conf = json.load(fp)
     fp.close()
 
@@ -1283,9 +1286,11 @@ if __name__ == '__main__':
                 timeout=int(config['SUBPROC_TIMEOUT']))
             except subprocess.TimeoutExpired:
                 print("Timeout running osmfilter for the OSM file.")
-                exit(EXIT_OSMFILTER_TIMEOUT)
+                sys.exit(EXIT_OSMFILTER_TIMEOUT)
 
-        pois, roads, rivers = osmpois.extract_pois(conf['pois'], conf['pois_types'])
+        # Parsed OSM data is cached along with the zones
+        pois_cache_filename = f'{os.path.splitext(config_filename)[0]}.pois.cache' if conf['cache_zones'] == True else None
+        pois, roads, rivers = osmpois.extract_pois(conf['pois'], conf['pois_types'], pois_cache_filename)
         add_pois(grid, pois)
         add_path(grid, roads, 'road')
         add_path(grid, rivers, 'river')
@@ -1293,16 +1298,16 @@ if __name__ == '__main__':
 
         # Load cache file if enabled
         time_begin = time.perf_counter()
-        cache_filename = f'{os.path.splitext(sys.argv[1])[0]}.cache'
+        cache_filename = f'{os.path.splitext(config_filename)[0]}.zones.cache'
         if conf['cache_zones'] == True and os.path.isfile(cache_filename):
             try:
                 print(f'Loading cache file {cache_filename}...')
-                fp = open(cache_filename, 'r')
-                load_zones(grid, json.load(fp))
+                fp = open(cache_filename, 'rb')
+                load_zones(grid, pickle.load(fp))
                 fp.close()
-            except json.JSONDecodeError:
+            except (pickle.UnpicklingError, EOFError):
                 print('The cache file is corrupted. Delete it and run the program again.')
-                exit(EXIT_CACHE_CORRUPTED)
+                sys.exit(EXIT_CACHE_CORRUPTED)
         else:
             # GeoJSON file
             try:
@@ -1324,7 +1329,7 @@ if __name__ == '__main__':
                 init_zones_by_polygon(grid)
                 if len(grid['zones_inside']) == 0:
                     print('No zones to classify!')
-                    exit(EXIT_NO_ZONES)
+                    sys.exit(EXIT_NO_ZONES)
 
                 if not conf.get('pois_use_all'):
                     init_pois_by_polygon(grid)
@@ -1383,8 +1388,8 @@ if __name__ == '__main__':
         # Write cache file
         if conf['cache_zones'] == True and not os.path.isfile(cache_filename):
             print('Writing cache file... ', end='')
-            fp = open(cache_filename, 'w')
-            json.dump(grid['zones'], fp)
+            fp = open(cache_filename, 'wb')
+            pickle.dump(grid['zones'], fp, protocol=pickle.HIGHEST_PROTOCOL)
             fp.close()
             print('Done!')
 
@@ -1417,9 +1422,7 @@ if __name__ == '__main__':
         # Write a JSON file with results data
         if 'res_data' in conf.keys():
             print('- Results metadata')
-            n_edus = 0
-            for i in range(1, grid['M'] + 1):
-                n_edus += len(grid['edus'][i])
+            n_edus = sum(len(grid['edus'][i]) for i in range(1, grid['M'] + 1))
 
             res_data = {
                 'n_zones': len(grid['zones_inside']),
@@ -1446,13 +1449,10 @@ if __name__ == '__main__':
         fp.write(f'{header}\n')
 
         grid['zones_inside'].sort()
-        row = 0
-        for id in grid['zones_inside']:
-            data = f'{row}'
-            for key in list_keys:
-                data += f',{grid["zones"][id][key]}'
-            fp.write(f'{data}\n')
-            row += 1
+        fp.write(''.join(
+            f'{row},' + ','.join([f'{grid["zones"][id][key]}' for key in list_keys]) + '\n'
+            for row, id in enumerate(grid['zones_inside'])
+        ))
 
         fp.close()
         
@@ -1463,13 +1463,8 @@ if __name__ == '__main__':
 
             data = 'id,type,lat,lon\n'
             fp.write(data)
-            row = 0
-            for i in range(1, grid['M'] + 1):
-                for zone in grid['edus'][i]:
-                    coordinates = f'[{zone["lon"]},{zone["lat"]}]'
-                    data = f'{row},{zone["edu_type"]},{zone["lat"]},{zone["lon"]}\n'
-                    fp.write(data)
-                    row += 1
+            edus = [zone for i in range(1, grid['M'] + 1) for zone in grid['edus'][i]]
+            fp.write(''.join(f'{row},{zone["edu_type"]},{zone["lat"]},{zone["lon"]}\n' for row, zone in enumerate(edus)))
             fp.close()
 
         # Write a CSV file with PoIs
@@ -1479,11 +1474,7 @@ if __name__ == '__main__':
             
             data = 'id,lat,lon,weight\n'
             fp.write(data)
-            row = 0
-            for poi in pois:
-                data = f'{row},{poi["lat"]},{poi["lon"]},{poi["weight"]}\n'
-                fp.write(data)
-                row += 1
+            fp.write(''.join(f'{row},{poi["lat"]},{poi["lon"]},{poi["weight"]}\n' for row, poi in enumerate(pois)))
             fp.close()
 
         # Write a CSV file with roads zones
@@ -1493,13 +1484,8 @@ if __name__ == '__main__':
             
             data = 'id,lat,lon\n'
             fp.write(data)
-            row = 0
-            for id in grid['zones_inside']:
-                zone = grid['zones'][id]
-                if zone['is_road']:
-                    data = f'{row},{zone["lat"]},{zone["lon"]}\n'
-                    fp.write(data)
-                    row += 1
+            roads = [grid['zones'][id] for id in grid['zones_inside'] if grid['zones'][id]['is_road']]
+            fp.write(''.join(f'{row},{zone["lat"]},{zone["lon"]}\n' for row, zone in enumerate(roads)))
             fp.close()
         
         # Write a CSV file with river zones
@@ -1509,13 +1495,8 @@ if __name__ == '__main__':
             
             data = 'id,lat,lon\n'
             fp.write(data)
-            row = 0
-            for id in grid['zones_inside']:
-                zone = grid['zones'][id]
-                if zone['is_river']:
-                    data = f'{row},{zone["lat"]},{zone["lon"]}\n'
-                    fp.write(data)
-                    row += 1
+            rivers = [grid['zones'][id] for id in grid['zones_inside'] if grid['zones'][id]['is_river']]
+            fp.write(''.join(f'{row},{zone["lat"]},{zone["lon"]}\n' for row, zone in enumerate(rivers)))
             fp.close()
         
         # Write a CSV file with elevation data
@@ -1525,11 +1506,10 @@ if __name__ == '__main__':
             
             data = 'id,elevation,lat,lon\n'
             fp.write(data)
-            row = 0
-            for id in grid['zones_inside']:
-                data = f'{row},{float(grid["zones"][id]["elevation"])},{grid["zones"][id]["lat"]},{grid["zones"][id]["lon"]}\n'
-                fp.write(data)
-                row += 1
+            fp.write(''.join(
+                f'{row},{float(grid["zones"][id]["elevation"])},{grid["zones"][id]["lat"]},{grid["zones"][id]["lon"]}\n'
+                for row, id in enumerate(grid['zones_inside'])
+            ))
             fp.close()
         
         # Write a CSV file with slope data
@@ -1539,11 +1519,10 @@ if __name__ == '__main__':
             
             data = 'id,slope,lat,lon\n'
             fp.write(data)
-            row = 0
-            for id in grid['zones_inside']:
-                data = f'{row},{float(grid["zones"][id]["slope"])},{grid["zones"][id]["lat"]},{grid["zones"][id]["lon"]}\n'
-                fp.write(data)
-                row += 1
+            fp.write(''.join(
+                f'{row},{float(grid["zones"][id]["slope"])},{grid["zones"][id]["lat"]},{grid["zones"][id]["lon"]}\n'
+                for row, id in enumerate(grid['zones_inside'])
+            ))
             fp.close()
         
         # Write a CSV file with connectivity data
@@ -1553,18 +1532,31 @@ if __name__ == '__main__':
             
             data = 'id,connectivity,nets,lat,lon\n'
             fp.write(data)
-            row = 0
-            for id in grid['zones_inside']:
-                data = f'{row},{float(grid["zones"][id]["dpconn"])},\"{grid["zones"][id]["dpconn_nets"]}\",{grid["zones"][id]["lat"]},{grid["zones"][id]["lon"]}\n'
-                fp.write(data)
-                row += 1
+            fp.write(''.join(
+                f'{row},{float(grid["zones"][id]["dpconn"])},\"{grid["zones"][id]["dpconn_nets"]}\",{grid["zones"][id]["lat"]},{grid["zones"][id]["lon"]}\n'
+                for row, id in enumerate(grid['zones_inside'])
+            ))
             fp.close()
 
         print('Done.')
-        exit(EXIT_OK)
+        sys.exit(EXIT_OK)
 
     except MemoryError:
         print('--- Memory limit reached! ---')
         print(f'riskzones is configured to use at most {RES_MEM_SOFT} bytes of memory.')
         print('If you think this limit is too low, you can raise it by setting the value of RES_MEM_SOFT in this script.')
-        exit(EXIT_NO_MEMORY)
+        sys.exit(EXIT_NO_MEMORY)
+
+if __name__ == '__main__':
+    """
+    Main program.
+    """
+    if len(sys.argv) < 2:
+        print(f'Use: {sys.argv[0]} config.json\n')
+        print('config.json is a configuration file in JSON format. See examples in conf folder.')
+        sys.exit(EXIT_HELP)
+
+    # Python multiprocessing start method
+    mp.set_start_method('spawn')
+
+    main(sys.argv[1])
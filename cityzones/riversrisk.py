@@ -27,10 +27,7 @@ risks:
 - riversrisk.init_zones(grid)
 """
 
-from dotenv import dotenv_values
-import math
-import os
-import multiprocessing as mp
+import numpy as np
 try:
     from config import *
     import utils
@@ -39,54 +36,59 @@ except ModuleNotFoundError:
     from cityzones import utils
 
 # Load current directory .env or default configuration file
-CONF_DEFAULT_PATH='/etc/cityzones/maps-service.conf'
-if os.path.exists('.env'):
-    config = dotenv_values('.env')
-elif os.path.exists(CONF_DEFAULT_PATH):
-    config = dotenv_values(CONF_DEFAULT_PATH)
-
-MP_WORKERS=None
+config = get_config()
 
 def init_zones(grid: dict):
     """
     Initialize every zone in the grid and set their distance to a river.
     """
     print("Setting zones' river distance... ", end='')
-    
-    # Initialize grid structure
-    for zone in grid['zones']:
-        zone['river_dist'] = math.inf
-        zone['hrdiff'] = 0
-
-    # Collect all zones that are marked as a river zone
-    river_zones_ids = []
-    for zone in grid['zones']:
-        if zone['is_river']:
-            river_zones_ids.append(zone['id'])
-
-    # Check all zones against all rivers data
-    with mp.Pool(processes=MP_WORKERS) as pool:
-        payload = []
-        for zone in grid['zones']:
-            payload.append((grid, zone, river_zones_ids))
-        dists = pool.starmap(__get_distance_from_river, payload)
-    
-    for res in dists:
-        grid['zones'][res[0]]['river_dist'] = res[1]
-        grid['zones'][res[0]]['hrdiff'] = res[2]
+
+    is_river = utils.__get_zones_column(grid, 'is_river').astype(bool).reshape(grid['grid_y'], grid['grid_x'])
+    dist, nearest = __get_nearest_river(is_river)
+
+    # Height difference from the nearest river zone
+    hrdiff = np.zeros(len(dist))
+    if is_river.any():
+        elevations = utils.__get_zones_column(grid, 'elevation')
+        hrdiff = elevations - elevations[nearest]
+
+    utils.__set_zones_column(grid, 'river_dist', dist)
+    utils.__set_zones_column(grid, 'hrdiff', hrdiff)
 
     print('Done!')
 
-def __get_distance_from_river(grid: dict, zone: dict, rivers: list):
+def __get_nearest_river(is_river: np.ndarray) -> tuple:
     """
-    Get the distance of a zone from the nearest river.
+    Get the distance in the grid of every zone to the nearest river zone and
+    the id of that river zone, the one with the lowest id on ties. The nearest
+    river zone in each row is found first, then the rows are combined moving
+    away from each zone's row until no closer river zone can be found.
     """
-    distance = math.inf
-    hdiff = 0
-    for id in rivers:
-        zone_dist = utils.__calculate_distance_in_grid(grid, zone, grid['zones'][id])
-        if zone_dist < distance:
-            distance = zone_dist
-            hdiff = zone['elevation'] - grid['zones'][id]['elevation']
-
-    return (zone['id'], distance, hdiff)
+    grid_y, grid_x = is_river.shape
+    cols = np.arange(grid_x)
+
+    # Nearest river zone in the same row, on the left and on the right
+    left = np.maximum.accumulate(np.where(is_river, cols, -1), axis=1)
+    right = np.minimum.accumulate(np.where(is_river, cols, grid_x)[:, ::-1], axis=1)[:, ::-1]
+    left_dist = np.where(left >= 0, cols - left, np.inf)
+    right_dist = np.where(right < grid_x, right - cols, np.inf)
+    use_left = left_dist <= right_dist
+    row_dist = np.where(use_left, left_dist, right_dist) ** 2
+    row_ids = np.arange(grid_y)[:, None] * grid_x + np.where(use_left, left, right)
+
+    # Squared distance and id of the nearest river zone, checking the rows k
+    # rows below and above each zone at each step
+    best_dist = row_dist.copy()
+    best_ids = row_ids.copy()
+    k = 1
+    while k < grid_y and k ** 2 <= best_dist.max():
+        for dst, src in ((slice(k, None), slice(None, -k)), (slice(None, -k), slice(k, None))):
+            dist = row_dist[src] + k ** 2
+            ids = row_ids[src]
+            closer = (dist < best_dist[dst]) | ((dist == best_dist[dst]) & (ids < best_ids[dst]))
+            best_dist[dst] = np.where(closer, dist, best_dist[dst])
+            best_ids[dst] = np.where(closer, ids, best_ids[dst])
+        k += 1
+
+    return np.sqrt(best_dist).ravel(), best_ids.ravel()
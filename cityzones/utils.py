@@ -1,4 +1,12 @@
 import math
+import functools
+import numpy as np
+
+# Earth radius in meters
+EARTH_RADIUS = 6378137
+
+# Length in meters of a degree of latitude
+METERS_PER_DEGREE = math.radians(EARTH_RADIUS)
 
 def __calculate_distance(a: dict, b: dict) -> float:
     """
@@ -8,36 +16,92 @@ def __calculate_distance(a: dict, b: dict) -> float:
     lat2 = math.radians(b['lat'])
     lon1 = math.radians(a['lon'])
     lon2 = math.radians(b['lon'])
-    r = 6378137
-    return 2 * r * math.asin(math.sqrt(math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2))
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2))
+
+def __calculate_distance_vec(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """
+    Calculate the distances between arrays of coordinates using haversine formula.
+    The arrays are broadcast against each other, so (n, 1) and (1, m) arrays
+    result in a (n, m) distance matrix.
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    lon1 = np.radians(lon1)
+    lon2 = np.radians(lon2)
+    return __calculate_distance_rad(lat1, lon1, np.cos(lat1), lat2, lon2, np.cos(lat2))
+
+def __calculate_distance_rad(lat1: np.ndarray, lon1: np.ndarray, cos_lat1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray, cos_lat2: np.ndarray) -> np.ndarray:
+    """
+    Calculate the distances between arrays of coordinates in radians using
+    haversine formula, given the cosines of their latitudes. Callers computing
+    distances to the same points many times can convert them only once.
+    """
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * np.sin((lon2 - lon1) / 2) ** 2))
+
+def __calculate_distance_flat(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray, cos_lat: np.ndarray) -> np.ndarray:
+    """
+    Calculate the distances between arrays of coordinates in a local
+    equirectangular projection, where cos_lat is the cosine of the mean
+    latitude of each pair. Over the small distances within a grid it is very
+    close to the haversine formula, without its trigonometric functions.
+    """
+    return METERS_PER_DEGREE * np.sqrt(((lon2 - lon1) * cos_lat) ** 2 + (lat2 - lat1) ** 2)
 
-def __calculate_distance_in_grid(grid: dict, a: dict, b: dict) -> int:
+def __calculate_distance_in_grid(grid: dict, a: int, b: int) -> float:
     """
-    Calculate the distance from a to b in the grid.
+    Calculate the distance from the zone with id a to the zone with id b in
+    the grid.
     """
-    x1 = a['id'] % grid['grid_x']
-    x2 = b['id'] % grid['grid_x']
-    y1 = int(a['id'] / grid['grid_x'])
-    y2 = int(b['id'] / grid['grid_x'])
-    return math.sqrt(abs(x2 - x1) ** 2 + abs(y2 - y1) ** 2)
+    y1, x1 = divmod(a, grid['grid_x'])
+    y2, x2 = divmod(b, grid['grid_x'])
+    return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
 
-def __get_spiral_path(grid: dict, range_radius: int) -> list:
+def __get_distance_sq_limit(distance: float) -> int:
+    """
+    Get the smallest squared distance in the grid whose distance is not less
+    than distance, so that checking a distance with `math.sqrt(d) < distance`
+    is the same as checking its square with `d < limit`.
+    """
+    limit = math.ceil(distance ** 2)
+    while limit > 0 and math.sqrt(limit - 1) >= distance:
+        limit -= 1
+    while math.sqrt(limit) < distance:
+        limit += 1
+    return limit
+
+def __get_spiral_path(grid: dict, range_radius: int) -> np.ndarray:
     """
     Compute a spiral path for zone search whithin a range.
     """
-    steps = []
-    step = -1
-    max_steps = (2 * range_radius + 1) ** 2 - 1
+    return __get_spiral_steps(grid['grid_x'], range_radius)
 
-    while True:
-        step_signal = int(step / abs(step))
-        for s in range(0, step, step_signal):
-            steps.append(step_signal * grid['grid_x'])
-            if len(steps) >= max_steps: return steps
+@functools.lru_cache(maxsize=16)
+def __get_spiral_steps(grid_x: int, range_radius: int) -> np.ndarray:
+    """
+    Compute the steps of a spiral path in a grid with grid_x columns. The path
+    goes 1 step down and left, 2 steps up and right, 3 steps down and left and
+    so on. The array is shared by the callers, so it is read-only.
+    """
+    max_steps = math.ceil((2 * range_radius + 1) ** 2 - 1)
+    n = np.arange(1, math.isqrt(max_steps) + 2)
+    signal = np.where(n % 2 == 1, -1, 1)
+    steps = np.repeat(np.column_stack((signal * grid_x, signal)).ravel(), np.repeat(n, 2))[:max_steps]
+    steps.flags.writeable = False
+    return steps
 
-        for s in range(0, step, step_signal):
-            steps.append(step_signal)
-            if len(steps) >= max_steps: return steps
+def __get_zones_column(grid: dict, key: str, ids: list = None) -> np.ndarray:
+    """
+    Get a field of the zones as an array of floats, from every zone or only
+    from the zones with the given ids.
+    """
+    zones = grid['zones'] if ids is None else [grid['zones'][id] for id in ids]
+    return np.fromiter((zone[key] for zone in zones), dtype=np.float64, count=len(zones))
 
-        step += step_signal
-        step *= -1
+def __set_zones_column(grid: dict, key: str, values: np.ndarray, ids: list = None):
+    """
+    Set a field of the zones from an array, in every zone or only in the zones
+    with the given ids.
+    """
+    zones = grid['zones'] if ids is None else [grid['zones'][id] for id in ids]
+    for zone, value in zip(zones, values.tolist()):
+        zone[key] = value
@@ -1,34 +1,78 @@
 import sys
+import re
 import json
 
+# ijson is optional, but it reads the features one by one instead of loading
+# the whole file in memory
+try:
+    import ijson
+except ModuleNotFoundError:
+    ijson = None
+
+# orjson is optional, but much faster than json for writing the cities files
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 FILEPATH = '/home/just/Downloads/GeoJSON/portugal_full.geojson'
 
-fp = open(FILEPATH, 'r')
-geojson = json.load(fp)
-fp.close()
+# Coordinate reference system of every city file
+CRS = {
+    "type": "name",
+    "properties": {
+        "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
+    }
+}
+
+# Constant parts of the city files encoded with orjson, around the city name
+# (twice) and its geometry, so only these are encoded for each city
+if orjson != None:
+    FILE_PARTS = (
+        b'{"type":"FeatureCollection","name":',
+        b',"crs":' + orjson.dumps(CRS) + b',"features":[{"type":"Feature","properties":{"NAME_1":',
+        b'},"geometry":',
+        b'}]}'
+    )
+
+def safe_filename(name: str) -> str:
+    '''
+    Replace the characters that can't be used in a filename, like path
+    separators, so a city name can't fail the writing or escape the directory.
+    '''
+    return re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', name).strip(' .') or '_'
 
-for feature in geojson['features']:
+fp = open(FILEPATH, 'rb')
+if ijson != None:
+    features = ijson.items(fp, 'features.item', use_float=True)
+else:
+    features = json.load(fp)['features']
+
+for feature in features:
     cidade = feature['properties']['NAME_2']
     coordenadas = feature['geometry']
+    filename = f'{safe_filename(cidade)}.geojson'
 
-    fp = open(f'{cidade}.geojson', 'w')
-    output = {
-        "type": "FeatureCollection",
-        "name": cidade,
-        "crs": {
-            "type": "name",
-            "properties": {
-                "name": "urn:ogc:def:crs:OGC:1.3:CRS84"
-            }
-        },
-        "features": [{
-            "type": "Feature",
-            "properties": {
-                "NAME_1": cidade
-            },
-            "geometry": coordenadas
-        }]
-    }
-    json.dump(output, fp)
-    fp.close()
+    if orjson != None:
+        name = orjson.dumps(cidade)
+        with open(filename, 'wb') as fp_city:
+            fp_city.writelines((FILE_PARTS[0], name, FILE_PARTS[1], name, FILE_PARTS[2], orjson.dumps(coordenadas), FILE_PARTS[3]))
+    else:
+        output = {
+            "type": "FeatureCollection",
+            "name": cidade,
+            "crs": CRS,
+            "features": [{
+                "type": "Feature",
+                "properties": {
+                    "NAME_1": cidade
+                },
+                "geometry": coordenadas
+            }]
+        }
+
+        with open(filename, 'w') as fp_city:
+            json.dump(output, fp_city)
     #sys.exit()
+
+fp.close()